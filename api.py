@@ -6,12 +6,14 @@ primarily with communication to/from the API's users."""
 
 import endpoints
 from google.appengine.ext import ndb
-from google.appengine.api import (taskqueue)
 from protorpc import (
     remote,
     messages,
     message_types)
 
+from cards import (
+    RANKS,
+    format_cards)
 from forms import (
     StringMessage,
     StringRepeatedMessage,
@@ -22,33 +24,66 @@ from forms import (
     AllGameHistory,
     PlayerHandForm,
     AllUserScores,
-    MoveForm)
+    MoveForm,
+    StatForm,
+    StatsForm,
+    CallStatsForm,
+    AllCallStats)
 from models.game import (
     Game,
-    faces)
-from models.player import Player
-from models.move import Move
+    LAYOUTS,
+    LAYOUT_EMBEDDED,
+    LAYOUT_PLAYERS)
+from models import counter
+from models.archived_game import ArchivedGame
+from models.migration import Migration
 from models.user import User
 from utils import (
     get_by_urlsafe,
     check_user_exists,
-    get_player_by_game)
+    get_player_by_game,
+    fetch_page,
+    fetch_page_async,
+    get_page_limit,
+    parse_cursor,
+    slice_page,
+    transaction_with_backoff)
+from game_cache import (
+    load_game,
+    store_game,
+    evict_game,
+    get_cache_counts)
+from instrumentation import instrumented, get_call_totals
+from scheduling import (
+    schedule_scoreboard_refresh,
+    get_trigger_counts)
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(
     player1=messages.StringField(1, required=True),
     player2=messages.StringField(2, required=True),
     cards_dealt=messages.IntegerField(3, required=False),
-    matches_to_win=messages.IntegerField(4, required=False))
+    matches_to_win=messages.IntegerField(4, required=False),
+    layout=messages.StringField(5, required=False))
 
 USER_GAMES_REQUEST = endpoints.ResourceContainer(
     username=messages.StringField(1, required=True),
-    active_only=messages.BooleanField(2, required=True))
+    active_only=messages.BooleanField(2, required=True),
+    limit=messages.IntegerField(3, required=False),
+    cursor=messages.StringField(4, required=False),
+    summary=messages.BooleanField(5, required=False))
 
 GET_GAME_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1))
 
 GET_ALL_GAMES_REQUEST = endpoints.ResourceContainer(
-    active_only=messages.BooleanField(1, required=False))
+    active_only=messages.BooleanField(1, required=False),
+    limit=messages.IntegerField(2, required=False),
+    cursor=messages.StringField(3, required=False),
+    summary=messages.BooleanField(4, required=False))
+
+PAGE_REQUEST = endpoints.ResourceContainer(
+    limit=messages.IntegerField(1, required=False),
+    cursor=messages.StringField(2, required=False))
 
 CANCEL_GAME_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1))
@@ -64,10 +99,20 @@ USER_REQUEST = endpoints.ResourceContainer(
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1, required=True),
     username=messages.StringField(2, required=True),
-    guess=messages.StringField(3, required=True))
+    guess=messages.StringField(3, required=True),
+    expected_version=messages.IntegerField(4, required=False))
 
 GAME_HISTORY_REQUEST = endpoints.ResourceContainer(
-    urlsafe_game_key=messages.StringField(1, required=True))
+    urlsafe_game_key=messages.StringField(1, required=True),
+    limit=messages.IntegerField(2, required=False),
+    cursor=messages.StringField(3, required=False))
+
+SCOREBOARD_BATCH_SIZE = 500
+
+# a listing cursor with this prefix pages through archived games, which are
+# listed after every live game
+ARCHIVED_CURSOR = 'archived:'
+
 
 
 @endpoints.api(name='go_fish', version='v1')
@@ -78,45 +123,49 @@ class GoFishApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
     def create_user(self, request):
         """Create a User. Requires a unique username"""
         username = request.username.title()
 
-        # check to see if user already exists
-        if User.query(User.name == username).get():
+        # create checks the key in a transaction, users that are not
+        # rekeyed yet are only found by name
+        user = None
+        if Migration.is_done('rekey') or not User.get_by_name(username):
+            user = User.create(username, email=request.email)
+
+        if not user:
             raise endpoints.ConflictException(
                 'A User with that name already exists!')
-        else:
-            user = User(name=username, email=request.email)
-            user.put()
 
-        # Use a task queue to update the average attempts remaining.
-        # This operation is not needed to complete the creation of a new game
-        # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_scoreboard')
+        schedule_scoreboard_refresh(user_created=True)
 
         return StringMessage(message='User {} created!'.format(
             request.username))
 
-    @endpoints.method(response_message=StringRepeatedMessage,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=StringRepeatedMessage,
                       path='user/all',
                       name='get_all_users',
                       http_method='GET')
+    @instrumented
     def get_all_users(self, request):
-        """Returns list of all users"""
-        users = User.query()
+        """Returns a page of all users"""
+        users, next_cursor = fetch_page(User.query(), request)
 
         # make sure there are users
-        if users.count() == 0:
+        if not users and not request.cursor:
             raise endpoints.NotFoundException('No users found')
 
-        return StringRepeatedMessage(messages=[user.name for user in users])
+        return StringRepeatedMessage(messages=[user.name for user in users],
+                                     next_cursor=next_cursor)
 
     @endpoints.method(request_message=NEW_GAME_REQUEST,
                       response_message=GameForm,
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrumented
     def new_game(self, request):
         """Creates new game"""
 
@@ -138,26 +187,32 @@ class GoFishApi(remote.Service):
         if not cards:
             cards = 5
 
-        # make sure players don't have an active game already
-        game = Game.query(ndb.AND(Game.player_names == player1.name,
-                                  Game.player_names == player2.name,
-                                  Game.game_over == False)).get()
+        # storage layout of the game, see models.game.LAYOUTS
+        layout = request.layout or LAYOUT_PLAYERS
+        if layout not in LAYOUTS:
+            raise endpoints.BadRequestException(
+                'Layout must be one of {}'.format(', '.join(LAYOUTS)))
+
+        # make sure players don't have an active game already, a game in
+        # both users' active games is shared
+        shared = set(player1.active_games) & set(player2.active_games)
+        game = None
+        if shared:
+            game = load_game(shared.pop().urlsafe())
 
         if game:
             return game.to_form('Game already exists')
         else:
-            game = Game.new_game(player1, player2, matches, cards)
-
-        # Use a task queue to update the average attempts remaining.
-        # This operation is not needed to complete the creation of a new game
-        # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_scoreboard')
+            game = Game.new_game(player1, player2, matches, cards,
+                                 layout=layout)
 
         if game.game_over:
+            schedule_scoreboard_refresh(game_over=True)
             return game.to_form(
                 "Game over, {} is the winner".format(
                     game.winner))
 
+        store_game(game)
         return game.to_form('Please make guess')
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
@@ -165,68 +220,71 @@ class GoFishApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrumented
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = load_game(request.urlsafe_game_key)
+
+        # finished games are moved to ArchivedGame under the same key
+        if not game:
+            game = ArchivedGame.get_by_urlsafe(request.urlsafe_game_key)
+
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
 
         if game.game_over:
             return game.to_form(
                 "Game over, {} is the winner".format(
                     game.winner))
 
-        if game:
-            return game.to_form('Your move {}'.format(game.turn))
-
-        else:
-            raise endpoints.NotFoundException('Game not found!')
+        return game.to_form('Your move {}'.format(game.turn))
 
     @endpoints.method(request_message=USER_GAMES_REQUEST,
                       response_message=AllGamesForm,
                       path='user/{username}',
                       name='get_user_games',
                       http_method='GET')
+    @instrumented
     def get_user_games(self, request):
-        """Returns all games for a given user"""
+        """Returns a page of games for a given user"""
 
         # check to see if username is valid
         user = check_user_exists(request.username)
 
+        # active games are kept on the user, so no query is needed
+        if request.active_only:
+            return self._list_active_games(
+                user.active_games, request,
+                'No active games found for user {}'.format(user.name))
+
         games = Game.query(ndb.AND(Game.player_names == user.name))
+        archived = ArchivedGame.query(ArchivedGame.player_names == user.name)
         error_msg = 'No games found for user {}'.format(user.name)
 
-        # get active_only games by filtering game_over = false
-        if request.active_only:
-            games = games.filter(Game.game_over != request.active_only)
-            error_msg = 'No active games found for user {}'.format(user.name)
-
-        if games.count():
-            return AllGamesForm(games=[game.to_form("n/a") for game in games])
-        else:
-            raise endpoints.NotFoundException(error_msg)
+        return self._list_games(games, request, error_msg, archived)
 
     @endpoints.method(request_message=GET_ALL_GAMES_REQUEST,
                       response_message=AllGamesForm,
                       path='games',
                       name='get_all_games',
                       http_method='GET')
+    @instrumented
     def get_all_games(self, request):
-        """Returns all games"""
+        """Returns a page of all games"""
 
         if request.active_only:
-            games = Game.query(Game.game_over == False)
-        else:
-            games = Game.query()
+            return self._list_games(Game.query(Game.game_over == False),
+                                    request, 'No games found')
 
-        if games.count() >= 1:
-            return AllGamesForm(games=[game.to_form("n/a") for game in games])
-        else:
-            raise endpoints.NotFoundException('No games found')
+        return self._list_games(Game.query(), request, 'No games found',
+                                ArchivedGame.query())
 
     @endpoints.method(request_message=CANCEL_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}/cancel',
                       name='cancel_game',
                       http_method='DELETE')
+    @instrumented
     def cancel_game(self, request):
         """Cancel a game that is in progress."""
         """
@@ -239,19 +297,8 @@ class GoFishApi(remote.Service):
             endpoints.NotFoundException: If the game isn't found.
             endpoints.ForbiddenException: If the game is completed already it
             cannot be cancelled."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-
-        if not game:
-            raise endpoints.NotFoundException('Game not found.')
-        if game.game_over:
-            raise endpoints.ForbiddenException(
-                'Cannot cancel a completed game.')
-
-        players = Player.query(ancestor=game.key)
-        for player in players:
-            player.key.delete()
-
-        game.key.delete()
+        transaction_with_backoff(self._cancel_game, request.urlsafe_game_key)
+        evict_game(request.urlsafe_game_key)
         return StringMessage(message='Your game was succesfully cancelled.')
 
     @endpoints.method(request_message=HAND_REQUEST,
@@ -259,9 +306,13 @@ class GoFishApi(remote.Service):
                       path='game/{urlsafe_game_key}/player/{username}/hand',
                       name='get_player_hand',
                       http_method='GET')
+    @instrumented
     def get_player_hand(self, request):
         """Get players hand"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = load_game(request.urlsafe_game_key)
+
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
 
         if game.game_over:
             raise endpoints.ForbiddenException(
@@ -270,8 +321,8 @@ class GoFishApi(remote.Service):
         player = get_player_by_game(request.username, game)
 
         if player:
-            return PlayerHandForm(hand=str(player.hand),
-                                  matches=str(player.matches))
+            return PlayerHandForm(hand=format_cards(player.hand),
+                                  matches=format_cards(player.matches))
         else:
             raise endpoints.NotFoundException('Player not found!')
 
@@ -280,109 +331,387 @@ class GoFishApi(remote.Service):
                       path='game/{urlsafe_game_key}/player/{username}/move',
                       name='make_move',
                       http_method='PUT')
+    @instrumented
     def make_move(self, request):
         """Player Makes Guess. Returns results"""
         guess = request.guess.title()
 
-        # check and return if valid game
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        # see check if user entered Jacks instead of Jack
+        if guess.endswith('s'):
+            guess = guess[:-1]
 
-        if game.game_over:
-            raise endpoints.ForbiddenException(
-                'Illegal action: Game is already over.')
-
-        # check to see if user is valid and is in the game
-        player = get_player_by_game(request.username, game)
-
-        if not player:
-            raise endpoints.NotFoundException('Player is not in this game')
-
-        # make sure guess is valid. Check numbers and then faces
-        try:
-
-            if int(guess) > 1 and int(guess) < 11:
-                move = game.make_guess(game, player, guess)
+        # make sure guess is a valid rank, numbers 2-10 or a face card
+        if guess not in RANKS:
+            raise endpoints.BadRequestException('Invalid Guess')
 
-            else:
-                raise endpoints.BadRequestException('Invalid Guess')
-
-        except:
-
-            # build list of face cards to check guess against
-            face_cards = []
-            for key, value in faces.iteritems():
-                face_cards.append(value)
-
-            # see check if user entered Jacks instead of Jack
-            if guess[-1] == "s":
-                guess = guess[:-1]
+        # reject a stale move from the cached snapshot before any
+        # transaction. The snapshot may lag the datastore, so only a client
+        # that is behind it can be rejected here.
+        if request.expected_version is not None:
+            cached = load_game(request.urlsafe_game_key)
+            if cached and cached.version > request.expected_version:
+                self._check_version(cached, request.expected_version)
 
-            # Since guess is not a number, check if a valid face card
-            if guess in face_cards:
-                move = game.make_guess(game, player, guess)
-            else:
-                raise endpoints.BadRequestException('Invalid Guess')
-
-        # refresh player entity for any changes to hand
-        player = get_player_by_game(request.username, game)
+        game, player, move = transaction_with_backoff(
+            self._apply_move, request.urlsafe_game_key, request.username,
+            guess, request.expected_version)
 
-        move.put()
+        # write through the committed state, finished games leave the cache
+        if game.game_over:
+            evict_game(request.urlsafe_game_key, game.version)
+        else:
+            store_game(game)
 
-        # update cache_scoreboard
-        taskqueue.add(url='/tasks/cache_scoreboard')
+        # only moves that end a game can change the scoreboard
+        schedule_scoreboard_refresh(game_over=move.game_over)
 
         return MoveForm(message=move.message,
                         match=move.match,
-                        hand=str(player.hand),
+                        hand=format_cards(player.hand),
                         num_matches=player.num_matches,
-                        game_over=move.game_over)
+                        game_over=move.game_over,
+                        version=game.version)
 
     @endpoints.method(request_message=GAME_HISTORY_REQUEST,
                       response_message=AllGameHistory,
                       path='game/{urlsafe_game_key}/history',
                       name='get_game_history',
                       http_method='GET')
+    @instrumented
     def get_game_history(self, request):
-        """Get user's guess history"""
+        """Get a page of the game's guess history. Moves of games stored
+        as child entities are read with a cursor query, archived and embedded
+        move logs are already in memory and paged by index."""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
 
-        moves = Move.query(ancestor=game.key).order(Move.time)
+        if not game:
+            archived = ArchivedGame.get_by_urlsafe(request.urlsafe_game_key)
+            if not archived:
+                raise endpoints.NotFoundException('Game not found!')
+            history, next_cursor = slice_page(archived.history_forms(),
+                                              request)
+
+        elif game.layout == LAYOUT_EMBEDDED:
+            moves, next_cursor = slice_page(game.move_log, request)
+            history = [move.to_form() for move in moves]
 
-        if moves.count():
-            return AllGameHistory(history=[move.to_form() for move in moves])
+        else:
+            moves, next_cursor = fetch_page(
+                game.move_query(), request)
+            history = [move.to_form() for move in moves]
+
+        if history or request.cursor:
+            return AllGameHistory(history=history, next_cursor=next_cursor)
 
         else:
             raise endpoints.NotFoundException(
                 'Game does not have any moves logged')
 
-    @endpoints.method(response_message=AllUserScores,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=AllUserScores,
                       path='games/scoreboard',
                       name='get_user_rankings',
                       http_method='GET')
+    @instrumented
     def get_user_rankings(self, request):
-        """Get the ScoreBoard"""
-        users = User.query().order(-User.win_ratio, -User.games)
-
-        if not users.count():
+        """Get a page of the ScoreBoard. Pages are cut by the records of the
+        last reconciliation, wins and losses are the current totals of the
+        users' sharded counters and each page is ordered by them, so
+        rankings across pages can lag by up to one UpdateScoreboard run."""
+        users, next_cursor = fetch_page(
+            User.query().order(-User.win_ratio, -User.games), request)
+
+        if not users and not request.cursor:
             raise endpoints.NotFoundException('No users found')
 
+        counts = counter.get_counts(
+            [name for user in users
+             for name in (counter.wins_counter(user.name),
+                          counter.losses_counter(user.name))])
+
+        scores = [user.to_form(counts[counter.wins_counter(user.name)],
+                               counts[counter.losses_counter(user.name)])
+                  for user in users]
+        scores.sort(key=lambda score: (score.win_ratio, score.games_played),
+                    reverse=True)
+
+        return AllUserScores(scores=scores, next_cursor=next_cursor)
+
+    @endpoints.method(response_message=StatsForm,
+                      path='stats/global',
+                      name='get_global_stats',
+                      http_method='GET')
+    @instrumented
+    def get_global_stats(self, request):
+        """Get the games started, played and active and the total moves"""
+        counts = counter.get_counts(counter.GLOBAL_COUNTERS)
+        return StatsForm(stats=[StatForm(name=name, value=counts[name])
+                                for name in counter.GLOBAL_COUNTERS])
+
+    @endpoints.method(response_message=StatsForm,
+                      path='games/scoreboard/stats',
+                      name='get_scoreboard_task_stats',
+                      http_method='GET')
+    @instrumented
+    def get_scoreboard_task_stats(self, request):
+        """Get counts of scoreboard refresh triggers and suppressed tasks"""
+        counts = get_trigger_counts()
+        return StatsForm(stats=[StatForm(name=name, value=value)
+                                for name, value in sorted(counts.items())])
+
+    @classmethod
+    def _list_games(cls, query, request, error_msg, archived_query=None):
+        """Returns an AllGamesForm with a page of full GameForms, or of
+        GameSummaryForms if request.summary is set. Games of archived_query
+        follow those of query, a page that finishes query is filled up from
+        archived_query. Raises NotFoundException with error_msg if the first
+        page is empty."""
+        if request.cursor and request.cursor.startswith(ARCHIVED_CURSOR):
+            if archived_query is None:
+                raise endpoints.BadRequestException('Invalid cursor')
+            forms, next_cursor = cls._archived_page(
+                archived_query, request, get_page_limit(request),
+                request.cursor[len(ARCHIVED_CURSOR):])
         else:
-            return AllUserScores(scores=[user.to_form() for user in users])
+            if request.summary:
+                forms, next_cursor = cls._games_to_summaries(
+                    query, request, request.active_only)
+            else:
+                forms, next_cursor = cls._games_to_forms_async(
+                    query, request).get_result()
+
+            if archived_query is not None and next_cursor is None:
+                remaining = get_page_limit(request) - len(forms)
+                if remaining:
+                    archived, next_cursor = cls._archived_page(
+                        archived_query, request, remaining, None)
+                    forms += archived
+                else:
+                    next_cursor = ARCHIVED_CURSOR
+
+        if request.summary:
+            response = AllGamesForm(summaries=forms, next_cursor=next_cursor)
+        else:
+            response = AllGamesForm(games=forms, next_cursor=next_cursor)
+
+        if forms or request.cursor:
+            return response
+        else:
+            raise endpoints.NotFoundException(error_msg)
 
     @staticmethod
-    def _cache_scoreboard():
-        """Populates User win/loss records for the scoreboard"""
-        games = Game.query()
-        users = User.query()
+    def _archived_page(query, request, limit, cursor):
+        """Fetches limit archived games of a query from a urlsafe cursor and
+        builds their summaries or full forms. Returns the forms and the next
+        page cursor, which carries the ARCHIVED_CURSOR prefix."""
+        games, cursor, more = query.fetch_page(
+            limit, start_cursor=parse_cursor(cursor))
+        if request.summary:
+            forms = [game.to_summary_form() for game in games]
+        else:
+            forms = [game.to_form("n/a") for game in games]
+
+        if more and cursor:
+            return forms, ARCHIVED_CURSOR + cursor.urlsafe()
+        return forms, None
+
+    @staticmethod
+    def _list_active_games(keys, request, error_msg):
+        """Returns an AllGamesForm for a user's active game keys, in one page
+        since the list is small. Raises NotFoundException with error_msg if
+        there are none."""
+        if request.cursor:
+            return AllGamesForm()
+
+        games = [game for game in ndb.get_multi(keys) if game]
+
+        if not games:
+            raise endpoints.NotFoundException(error_msg)
+
+        if request.summary:
+            return AllGamesForm(
+                summaries=[game.to_summary_form() for game in games])
+
+        futures = [game.to_form_async("n/a") for game in games]
+        return AllGamesForm(games=[future.get_result() for future in futures])
+
+    @staticmethod
+    def _games_to_summaries(query, request, active_only):
+        """Fetches a page of games of a query as a projection and builds
+        their GameSummaryForms. The deck, history and players are never
+        loaded. A query filtered on game_over can't project it."""
+        projection = [Game.player1, Game.player2, Game.turn, Game.winner]
+        if not active_only:
+            projection.insert(0, Game.game_over)
+
+        games, next_cursor = fetch_page(query, request, projection=projection)
+        game_over = False if active_only else None
+        return ([game.to_summary_form(game_over) for game in games],
+                next_cursor)
 
-        for user in users:
-            user.wins = games.filter(Game.winner == user.name).count()
-            user.losses = games.filter(Game.loser == user.name).count()
-            user.games = user.wins + user.losses
+    @staticmethod
+    @ndb.tasklet
+    def _games_to_forms_async(query, request):
+        """Fetches a page of games of a query and builds their GameForms.
+        The player loads of all games go out in parallel instead of one game
+        at a time. Returns the forms and the next page cursor."""
+        games, next_cursor = yield fetch_page_async(query, request)
+        forms = yield [game.to_form_async("n/a") for game in games]
+        raise ndb.Return(forms, next_cursor)
+
+    @endpoints.method(response_message=StatsForm,
+                      path='games/cache/stats',
+                      name='get_game_cache_stats',
+                      http_method='GET')
+    @instrumented
+    def get_game_cache_stats(self, request):
+        """Get hit, miss, store and eviction counts of the game cache"""
+        counts = get_cache_counts()
+        return StatsForm(stats=[StatForm(name=name, value=value)
+                                for name, value in sorted(counts.items())])
+
+    @endpoints.method(response_message=AllCallStats,
+                      path='stats/calls',
+                      name='get_call_stats',
+                      http_method='GET')
+    @instrumented
+    def get_call_stats(self, request):
+        """Get the wall time and API call totals of every endpoint and task
+        handler"""
+        return AllCallStats(calls=[CallStatsForm(name=name, **totals)
+                                   for name, totals in sorted(
+                                       get_call_totals().items())])
+
+    @staticmethod
+    def _cancel_game(urlsafe_game_key):
+        """Deletes a game that is in progress with its players and moves and
+        removes it from the users' active games. Runs in a cross-group
+        transaction."""
+        game = get_by_urlsafe(urlsafe_game_key, Game)
 
-            if user.games:
-                user.win_ratio = float(user.wins) / float(user.games)
+        if not game:
+            raise endpoints.NotFoundException('Game not found.')
+        if game.game_over:
+            raise endpoints.ForbiddenException(
+                'Cannot cancel a completed game.')
+
+        game.cancel()
+
+    @staticmethod
+    def _check_version(game, expected_version):
+        """Raises ConflictException if the game has moved past the version
+        the client expected. Does nothing if no version was sent."""
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
 
-            user.put()
+        if expected_version is not None and game.version != expected_version:
+            raise endpoints.ConflictException(
+                'Game has changed, current version is {}'.format(
+                    game.version))
+
+    @classmethod
+    def _apply_move(cls, urlsafe_game_key, username, guess, expected_version):
+        """Reads the game and its players, applies a guess and writes the
+        move and every changed entity with one put_multi. A rejected guess
+        writes nothing. Runs in a cross-group transaction because game ends
+        also update both Users. A stale expected_version is rejected before
+        the players are read.
+        Returns the Game, the Player that moved and the Move."""
+        # check and return if valid game
+        game = get_by_urlsafe(urlsafe_game_key, Game)
+        cls._check_version(game, expected_version)
+
+        if game.game_over:
+            raise endpoints.ForbiddenException(
+                'Illegal action: Game is already over.')
+
+        # check to see if user is valid and is in the game
+        player = get_player_by_game(username, game)
+
+        move, changed = game.make_guess(game, player, guess)
+        if changed:
+            game.version += 1
+            if game not in changed:
+                changed.append(game)
+
+        entities = game.entities_to_put(move, changed)
+        if entities:
+            ndb.put_multi(entities)
+
+        return game, player, move
+
+    @staticmethod
+    def _cache_scoreboard():
+        """Backfills the users' wins and losses counters and the
+        games_played and active_games counters, and copies the users'
+        counter totals onto their User records that order the scoreboard.
+        Results are counted by Game.end_game, so this only runs occasionally
+        to backfill results from before the counters. Finished games are
+        paged through once and tallied in memory instead of counted per
+        user. A game ending while this runs can be missed by the tally, so
+        result counters are only ever raised to the tally, never lowered to
+        it. active_games is repaired both ways from a count of live games."""
+        tally = {}
+
+        # archived games first, so a game archived during the scan is
+        # missed rather than counted twice
+        queries = [(ArchivedGame.query(),
+                    [ArchivedGame.winner, ArchivedGame.loser]),
+                   (Game.query(Game.game_over == True),
+                    [Game.winner, Game.loser])]
+
+        for query, projection in queries:
+            cursor = None
+            more = True
+            while more:
+                games, cursor, more = query.fetch_page(
+                    SCOREBOARD_BATCH_SIZE,
+                    start_cursor=cursor,
+                    projection=projection)
+
+                for game in games:
+                    tally.setdefault(game.winner, [0, 0])[0] += 1
+                    tally.setdefault(game.loser, [0, 0])[1] += 1
+
+        cursor = None
+        more = True
+        while more:
+            users, cursor, more = User.query().fetch_page(
+                SCOREBOARD_BATCH_SIZE, start_cursor=cursor)
+
+            expected = {}
+            for user in users:
+                wins, losses = tally.get(user.name, (0, 0))
+                expected[counter.wins_counter(user.name)] = wins
+                expected[counter.losses_counter(user.name)] = losses
+
+            counts = counter.get_counts(expected)
+            for name, value in expected.items():
+                if counts[name] < value:
+                    counter.add_missing(name, value)
+                    counts[name] = value
+
+            # the record is raised in its own transaction, so a concurrent
+            # write to the User is not overwritten
+            for user in users:
+                wins = counts[counter.wins_counter(user.name)]
+                losses = counts[counter.losses_counter(user.name)]
+                if user.wins < wins or user.losses < losses:
+                    User.add_missing_results(user.key, wins, losses)
+
+        counter.add_missing(counter.GAMES_PLAYED,
+                            sum(wins for wins, losses in tally.values()))
+
+        # a game starting or ending during the count moves the total by one
+        # between the reads before and after it, and the count may or may
+        # not include it. Only a count outside that range is drift, and the
+        # difference is added as a delta so later increments are kept.
+        before = counter.count_shards(counter.ACTIVE_GAMES)
+        live = Game.query(Game.game_over == False).count()
+        after = counter.count_shards(counter.ACTIVE_GAMES)
+        if live > max(before, after):
+            counter.increment(counter.ACTIVE_GAMES, live - max(before, after))
+        elif live < min(before, after):
+            counter.increment(counter.ACTIVE_GAMES, live - min(before, after))
 
 api = endpoints.api_server([GoFishApi])
@@ -0,0 +1,122 @@
+"""harness.py - Shared setup for benchmarks that run the models against the
+App Engine SDK service stubs. The SDK must be importable, e.g. run with
+PYTHONPATH pointing at google_appengine."""
+
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, ROOT)
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb, testbed
+
+
+def setup_testbed():
+    """Activates a testbed with datastore, memcache and task queue stubs.
+    Returns the Testbed so the caller can deactivate it."""
+    bed = testbed.Testbed()
+    bed.activate()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_app_identity_stub()
+    bed.init_mail_stub()
+    disable_ndb_caches()
+    return bed
+
+
+def disable_ndb_caches():
+    """Turns off the ndb caches of the current thread's context, so every
+    datastore call is counted instead of ndb cache hits. Each thread has
+    its own context."""
+    ndb.get_context().set_cache_policy(False)
+    ndb.get_context().set_memcache_policy(False)
+
+
+class RpcCounter(object):
+    """Counts API calls per (service, method) made by the current thread
+    while active"""
+
+    _installed = False
+    _local = threading.local()
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+
+    @classmethod
+    def _active(cls):
+        if not hasattr(cls._local, 'counters'):
+            cls._local.counters = []
+        return cls._local.counters
+
+    @classmethod
+    def _hook(cls, service, call, request, response):
+        for counter in cls._active():
+            counter.calls[(service, call)] += 1
+
+    def __enter__(self):
+        if not RpcCounter._installed:
+            apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+                'benchmark_rpc_counter', RpcCounter._hook)
+            RpcCounter._installed = True
+        RpcCounter._active().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        RpcCounter._active().remove(self)
+
+    def total(self, service='datastore_v3'):
+        """Returns the number of calls made to a service"""
+        return sum(count for (name, call), count in self.calls.items()
+                   if name == service)
+
+
+class LatencyInjector(object):
+    """Sleeps before every API call to a service while active, so the stubs
+    answer about as slowly as the production services. The delay is added
+    in the calling thread before the call is sent, so async calls made
+    together wait one after another."""
+
+    _installed = False
+    _delays = {}
+
+    def __init__(self, **delays):
+        """delays are seconds by service name, e.g. datastore_v3=0.01"""
+        self.delays = delays
+
+    @classmethod
+    def _hook(cls, service, call, request, response):
+        delay = cls._delays.get(service)
+        if delay:
+            time.sleep(delay)
+
+    def __enter__(self):
+        if not LatencyInjector._installed:
+            apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+                'benchmark_latency', LatencyInjector._hook)
+            LatencyInjector._installed = True
+        LatencyInjector._delays.update(self.delays)
+        return self
+
+    def __exit__(self, *exc_info):
+        LatencyInjector._delays.clear()
+
+
+def timed(func, *args, **kwargs):
+    """Calls func with fresh ndb caches. Returns (result, seconds, counter)"""
+    ndb.get_context().clear_cache()
+    with RpcCounter() as counter:
+        start = time.time()
+        result = func(*args, **kwargs)
+        seconds = time.time() - start
+    return result, seconds, counter
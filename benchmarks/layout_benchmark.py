@@ -0,0 +1,95 @@
+"""layout_benchmark.py - Compares datastore RPCs and latency per call of the
+'players' layout, with Player and Move child entities, against the 'embedded'
+layout, with everything inside the Game entity.
+
+    python benchmarks/layout_benchmark.py [games] [moves per game]
+"""
+
+from __future__ import print_function
+
+import sys
+from collections import defaultdict
+
+from harness import setup_testbed, timed
+
+from google.appengine.api import memcache
+
+from api import (
+    GoFishApi,
+    GET_GAME_REQUEST,
+    GAME_HISTORY_REQUEST,
+    MAKE_MOVE_REQUEST)
+from cards import RANKS, card_rank
+from models.game import Game, LAYOUTS
+from models.user import User
+
+
+def create_games(count, layout):
+    """Creates count games of a layout that can't end on the deal"""
+    games = []
+    for i in xrange(count):
+        user1 = User.create('{}{}a'.format(layout, i))
+        user2 = User.create('{}{}b'.format(layout, i))
+        games.append(Game.new_game(user1, user2, 26, 7, seed=i,
+                                   layout=layout))
+    return games
+
+
+def run(layout, games, moves):
+    """Returns {call: [seconds, rpcs, calls]} for one layout"""
+    api = GoFishApi()
+    totals = defaultdict(lambda: [0.0, 0, 0])
+
+    def record(name, func, request):
+        # measure the datastore path rather than the game_cache snapshot
+        memcache.flush_all()
+        _, seconds, counter = timed(func, request)
+        totals[name][0] += seconds
+        totals[name][1] += counter.total()
+        totals[name][2] += 1
+
+    for game in create_games(games, layout):
+        urlsafe_key = game.key.urlsafe()
+        for _ in xrange(moves):
+            game = Game.get_by_id(game.key.id())
+            if game.game_over:
+                break
+            player = game.get_player(game.turn)
+            guess = RANKS[card_rank(player.hand.cards()[0])]
+
+            record('make_move', api.make_move,
+                   MAKE_MOVE_REQUEST.combined_message_class(
+                       urlsafe_game_key=urlsafe_key,
+                       username=game.turn,
+                       guess=guess))
+
+        record('get_game', api.get_game,
+               GET_GAME_REQUEST.combined_message_class(
+                   urlsafe_game_key=urlsafe_key))
+        record('get_game_history', api.get_game_history,
+               GAME_HISTORY_REQUEST.combined_message_class(
+                   urlsafe_game_key=urlsafe_key))
+
+    return totals
+
+
+def main(games, moves):
+    print('{:>10} {:>18} {:>10} {:>10}'.format(
+        'layout', 'call', 'ms/call', 'rpcs/call'))
+
+    for layout in LAYOUTS:
+        bed = setup_testbed()
+        try:
+            totals = run(layout, games, moves)
+        finally:
+            bed.deactivate()
+
+        for name in sorted(totals):
+            seconds, rpcs, calls = totals[name]
+            print('{:>10} {:>18} {:>10.2f} {:>10.2f}'.format(
+                layout, name, seconds * 1000 / calls, float(rpcs) / calls))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [20, 10][len(args):]))
@@ -0,0 +1,67 @@
+"""listing_benchmark.py - Measures get_all_games latency and datastore RPCs
+against the number of games, comparing building GameForms one game at a time
+with the tasklet based listing.
+
+    python benchmarks/listing_benchmark.py 10 50 100 250
+"""
+
+from __future__ import print_function
+
+import sys
+
+from harness import setup_testbed, timed
+
+from api import GoFishApi, GET_ALL_GAMES_REQUEST
+from models.game import Game
+from models.user import User
+from utils import MAX_PAGE_SIZE
+
+
+def create_games(count):
+    """Creates count games between distinct pairs of new users"""
+    for i in xrange(count):
+        user1 = User.create('bench{}a'.format(i))
+        user2 = User.create('bench{}b'.format(i))
+        Game.new_game(user1, user2, 6, 5)
+
+
+def sequential_listing():
+    """The old listing: one synchronous to_form per game"""
+    return [game.to_form('n/a') for game in Game.query()]
+
+
+def tasklet_listing():
+    """The get_all_games endpoint, paging through every game"""
+    api = GoFishApi()
+    games = []
+    cursor = None
+    while True:
+        request = GET_ALL_GAMES_REQUEST.combined_message_class(
+            active_only=False, limit=MAX_PAGE_SIZE, cursor=cursor)
+        response = api.get_all_games(request)
+        games.extend(response.games)
+        cursor = response.next_cursor
+        if not cursor:
+            return games
+
+
+def main(counts):
+    print('{:>7} {:>12} {:>10} {:>12} {:>10}'.format(
+        'games', 'seq ms', 'seq rpcs', 'tasklet ms', 'tasklet rpcs'))
+
+    for count in counts:
+        bed = setup_testbed()
+        try:
+            create_games(count)
+            _, seq_time, seq_rpcs = timed(sequential_listing)
+            _, async_time, async_rpcs = timed(tasklet_listing)
+        finally:
+            bed.deactivate()
+
+        print('{:>7} {:>12.1f} {:>10} {:>12.1f} {:>10}'.format(
+            count, seq_time * 1000, seq_rpcs.total(),
+            async_time * 1000, async_rpcs.total()))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10, 50, 100, 250])
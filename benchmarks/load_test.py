@@ -0,0 +1,187 @@
+"""load_test.py - Drives create_user, new_game, get_player_hand and make_move
+flows through GoFishApi from many threads against the App Engine SDK service
+stubs, and reports p50/p99 latency and datastore, memcache and task queue
+calls per endpoint call. Every service call can be slowed down to production
+like latency.
+
+    python benchmarks/load_test.py --threads 32 --games 5 --datastore-ms 10
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import ast
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from harness import (
+    LatencyInjector,
+    RpcCounter,
+    disable_ndb_caches,
+    setup_testbed)
+
+from api import (
+    GoFishApi,
+    HAND_REQUEST,
+    MAKE_MOVE_REQUEST,
+    NEW_GAME_REQUEST,
+    USER_REQUEST)
+
+SERVICES = (('datastore', 'datastore_v3'),
+            ('memcache', 'memcache'),
+            ('tasks', 'taskqueue'))
+
+
+class Results(object):
+    """Latency and API calls of every endpoint call, shared by the
+    workers"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = defaultdict(list)
+        self.calls = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    def call(self, name, method, request):
+        """Calls an endpoint method and records it under name. Returns the
+        response or None if the method raised."""
+        response = None
+        error = None
+        with RpcCounter() as counter:
+            start = time.time()
+            try:
+                response = method(request)
+            except Exception as e:
+                error = e
+            seconds = time.time() - start
+
+        with self.lock:
+            self.seconds[name].append(seconds)
+            for label, service in SERVICES:
+                self.calls[name][label] += counter.total(service)
+            if error is not None:
+                self.errors[name] += 1
+
+        return response
+
+
+def play(results, worker, games, max_moves):
+    """Plays games between two new users of a worker thread"""
+    disable_ndb_caches()
+    api = GoFishApi()
+
+    names = ['load{}a'.format(worker), 'load{}b'.format(worker)]
+    for name in names:
+        results.call('create_user', api.create_user,
+                     USER_REQUEST.combined_message_class(username=name))
+
+    for _ in range(games):
+        game = results.call(
+            'new_game', api.new_game,
+            NEW_GAME_REQUEST.combined_message_class(
+                player1=names[0], player2=names[1],
+                cards_dealt=5, matches_to_win=6))
+        if game is None:
+            continue
+
+        turn = game.turn
+        for _ in range(max_moves):
+            if turn is None:
+                break
+
+            hand = results.call(
+                'get_player_hand', api.get_player_hand,
+                HAND_REQUEST.combined_message_class(
+                    urlsafe_game_key=game.urlsafe_key, username=turn))
+            cards = ast.literal_eval(hand.hand) if hand and hand.hand else []
+            if not cards:
+                break
+
+            guess = cards[0]['rank']
+            move = results.call(
+                'make_move', api.make_move,
+                MAKE_MOVE_REQUEST.combined_message_class(
+                    urlsafe_game_key=game.urlsafe_key, username=turn,
+                    guess=guess))
+            if move is None or move.game_over:
+                break
+
+            # a match lets the player go again
+            if not move.match:
+                turn = names[1] if turn.lower() == names[0] else names[0]
+
+
+def percentile(values, fraction):
+    """Returns the value below which fraction of the sorted values fall"""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(results, elapsed):
+    total = sum(len(seconds) for seconds in results.seconds.values())
+    print('{} endpoint calls in {:.2f} s, {:.0f} calls/s'.format(
+        total, elapsed, total / elapsed))
+    print('{:<16} {:>7} {:>8} {:>8} {:>10} {:>10} {:>7} {:>7}'.format(
+        'endpoint', 'calls', 'p50 ms', 'p99 ms', 'datastore', 'memcache',
+        'tasks', 'errors'))
+
+    for name in sorted(results.seconds):
+        seconds = sorted(results.seconds[name])
+        calls = len(seconds)
+        print('{:<16} {:>7} {:>8.1f} {:>8.1f} {:>10.2f} {:>10.2f} {:>7.2f} '
+              '{:>7}'.format(
+                  name, calls,
+                  percentile(seconds, 0.5) * 1000,
+                  percentile(seconds, 0.99) * 1000,
+                  results.calls[name]['datastore'] / calls,
+                  results.calls[name]['memcache'] / calls,
+                  results.calls[name]['tasks'] / calls,
+                  results.errors[name]))
+
+
+def main(options):
+    bed = setup_testbed()
+    results = Results()
+    try:
+        with LatencyInjector(datastore_v3=options.datastore_ms / 1000,
+                             memcache=options.memcache_ms / 1000,
+                             taskqueue=options.taskqueue_ms / 1000):
+            workers = [threading.Thread(target=play,
+                                        args=(results, worker, options.games,
+                                              options.moves))
+                       for worker in range(options.threads)]
+
+            start = time.time()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.time() - start
+    finally:
+        bed.deactivate()
+
+    report(results, elapsed)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Load test GoFishApi against the SDK service stubs')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='concurrent players, each pair of users plays '
+                             'its games in one thread')
+    parser.add_argument('--games', type=int, default=3,
+                        help='games per thread')
+    parser.add_argument('--moves', type=int, default=100,
+                        help='moves after which a game is left unfinished')
+    parser.add_argument('--datastore-ms', type=float, default=0,
+                        help='latency added to every datastore call')
+    parser.add_argument('--memcache-ms', type=float, default=0,
+                        help='latency added to every memcache call')
+    parser.add_argument('--taskqueue-ms', type=float, default=0,
+                        help='latency added to every task queue call')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_args(sys.argv[1:]))
@@ -0,0 +1,239 @@
+"""simulator.py - Plays complete Go Fish games between scripted strategies
+with engine.py, without the datastore or the SDK, and reports moves/s,
+games/s, memory per game and the distribution of game lengths. Every game is
+seeded by its number, so a run gives the same games with any number of
+processes.
+
+    python benchmarks/simulator.py --games 100000
+    python benchmarks/simulator.py --games 1000000 --processes 0
+    python benchmarks/simulator.py --strategies memory random --cards 7
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cards import RANKS, card_rank
+from engine import apply_move, deal
+
+# a game still running after this many moves is stopped and counted as
+# unfinished, two empty handed players can't end a game on an empty deck
+MAX_MOVES = 2000
+
+PLAYER_NAMES = ('Player1', 'Player2')
+
+
+def lowest_rank(state, player, rng):
+    """Guesses the lowest rank in hand"""
+    return RANKS[card_rank(player.hand.cards()[0])]
+
+
+def random_rank(state, player, rng):
+    """Guesses a random card's rank from hand"""
+    return RANKS[card_rank(rng.choice(player.hand.cards()))]
+
+
+def remember_asks(state, player, rng):
+    """Guesses the rank the opponent asked for most recently that is still
+    in hand, the opponent must hold it unless it was matched since.
+    Otherwise guesses the rank held most often."""
+    opponent = state.opponent(player.name)
+    for guess in reversed(opponent.history):
+        if player.hand.has_rank(RANKS.index(guess)):
+            return guess
+
+    counts = Counter(card_rank(card) for card in player.hand.cards())
+    return RANKS[max(sorted(counts), key=counts.get)]
+
+
+STRATEGIES = {
+    'lowest': lowest_rank,
+    'random': random_rank,
+    'memory': remember_asks,
+}
+
+
+def deep_size(obj, seen=None):
+    """Returns the bytes used by obj and everything it refers to"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen)
+                    for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(item, seen) for item in obj)
+
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    for slot in getattr(type(obj), '__slots__', ()):
+        size += deep_size(getattr(obj, slot, None), seen)
+    return size
+
+
+def game_seed(number, options):
+    """Returns the seed of the deck and strategies of game number"""
+    return options.seed * 1000003 + number
+
+
+def play_game(number, options):
+    """Plays game number to the end.
+    Returns:
+        The number of moves and the index of the winning seat or None if the
+        game was stopped at MAX_MOVES."""
+    seed = game_seed(number, options)
+    rng = random.Random(seed)
+    strategies = [STRATEGIES[name] for name in options.strategies]
+
+    state = deal(PLAYER_NAMES, options.cards, options.matches, seed)
+
+    moves = 0
+    while not state.game_over and moves < MAX_MOVES:
+        seat = PLAYER_NAMES.index(state.turn)
+        player = state.players[seat]
+        guess = strategies[seat](state, player, rng)
+        state, events = apply_move(state, player.name, guess)
+        moves += 1
+
+    winner = PLAYER_NAMES.index(state.winner) if state.game_over else None
+    return moves, winner
+
+
+def play_range(args):
+    """Plays games start to stop. Returns the Counters of game lengths and
+    winning seats."""
+    start, stop, options = args
+    lengths = Counter()
+    winners = Counter()
+
+    for number in range(start, stop):
+        moves, winner = play_game(number, options)
+        lengths[moves] += 1
+        winners[winner] += 1
+
+    return lengths, winners
+
+
+def dealt_sizes(options):
+    """Returns the deep sizes of the dealt GameStates of the sampled games.
+    Measured apart from the timed run."""
+    return [deep_size(deal(PLAYER_NAMES, options.cards, options.matches,
+                           game_seed(number, options)))
+            for number in range(min(options.memory_sample, options.games))]
+
+
+def percentile(lengths, fraction):
+    """Returns the game length below which fraction of the games fall"""
+    total = sum(lengths.values())
+    running = 0
+    for moves in sorted(lengths):
+        running += lengths[moves]
+        if running >= fraction * total:
+            return moves
+    return 0
+
+
+def histogram(lengths, buckets=10, width=40):
+    """Returns the lines of a text histogram of game lengths"""
+    low, high = min(lengths), max(lengths)
+    step = max(1, (high - low + buckets) // buckets)
+    counts = Counter()
+    for moves, games in lengths.items():
+        counts[(moves - low) // step] += games
+
+    peak = max(counts.values())
+    return ['{:>5}-{:<5} {:>9} {}'.format(
+                low + bucket * step, low + (bucket + 1) * step - 1,
+                counts[bucket], '#' * int(width * counts[bucket] / peak))
+            for bucket in range(max(counts) + 1)]
+
+
+def run(options):
+    """Plays options.games games, split in chunks over options.processes
+    worker processes, and prints the report"""
+    processes = options.processes or multiprocessing.cpu_count()
+    chunk = max(1, min(options.chunk, options.games // processes or 1))
+    chunks = [(start, min(start + chunk, options.games), options)
+              for start in range(0, options.games, chunk)]
+
+    started = time.time()
+    if processes == 1:
+        results = [play_range(args) for args in chunks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(play_range, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    elapsed = time.time() - started
+
+    lengths = Counter()
+    winners = Counter()
+    for chunk_lengths, chunk_winners in results:
+        lengths.update(chunk_lengths)
+        winners.update(chunk_winners)
+
+    sizes = dealt_sizes(options)
+
+    moves = sum(length * games for length, games in lengths.items())
+
+    print('strategies   {} vs {}'.format(*options.strategies))
+    print('games        {} with {} cards dealt, {} matches to win'.format(
+        options.games, options.cards, options.matches))
+    print('processes    {}'.format(processes))
+    print('elapsed      {:.2f} s'.format(elapsed))
+    print('moves/s      {:,.0f}'.format(moves / elapsed))
+    print('games/s      {:,.0f}'.format(options.games / elapsed))
+    if sizes:
+        print('memory/game  {:,.0f} bytes dealt state, mean of {}'.format(
+            sum(sizes) / len(sizes), len(sizes)))
+    print('wins         {} {}, {} {}, unfinished {}'.format(
+        options.strategies[0], winners[0],
+        options.strategies[1], winners[1], winners[None]))
+    print('moves/game   mean {:.1f} min {} p50 {} p90 {} p99 {} max {}'.format(
+        moves / options.games, min(lengths), percentile(lengths, 0.5),
+        percentile(lengths, 0.9), percentile(lengths, 0.99),
+        max(lengths)))
+    for line in histogram(lengths):
+        print(line)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Simulate Go Fish games with engine.py')
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--processes', type=int, default=1,
+                        help='worker processes, 0 for one per core')
+    parser.add_argument('--chunk', type=int, default=5000,
+                        help='games per task sent to a worker')
+    parser.add_argument('--strategies', nargs=2, default=['memory', 'random'],
+                        choices=sorted(STRATEGIES),
+                        metavar='STRATEGY',
+                        help='strategy of the first and second player, one '
+                             'of ' + ', '.join(sorted(STRATEGIES)))
+    parser.add_argument('--cards', type=int, default=5,
+                        help='cards dealt to each player')
+    parser.add_argument('--matches', type=int, default=6,
+                        help='matches to win')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory-sample', type=int, default=1000,
+                        help='games whose dealt state is measured')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args(sys.argv[1:]))
@@ -0,0 +1,139 @@
+"""cards.py - Compact card encoding. A card is stored as a small integer from
+0 to 51, suit * 13 + rank index. Cards are only turned into suit and rank
+names at the API edge."""
+
+import json
+
+SUITS = ['Spades', 'Clubs', 'Hearts', 'Diamonds']
+RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', '10',
+         'Jack', 'Queen', 'King', 'Ace']
+DECK_SIZE = len(SUITS) * len(RANKS)
+
+# first byte of a packed card list, JSON lists start with '['
+PACKED_VERSION = 1
+JSON_MARKER = ord('[')
+
+
+def make_card(suit, rank):
+    """Returns the card for a suit index and rank index"""
+    return suit * len(RANKS) + rank
+
+
+def card_rank(card):
+    """Returns the rank index of a card"""
+    return card % len(RANKS)
+
+
+def card_suit(card):
+    """Returns the suit index of a card"""
+    return card // len(RANKS)
+
+
+def rank_index(label):
+    """Returns the rank index for a rank name such as '10' or 'Jack'.
+    Raises ValueError if the name is not a rank."""
+    return RANKS.index(label)
+
+
+def card_to_dict(card):
+    """Returns the human readable {'suit': ..., 'rank': ...} form of a card"""
+    return {'suit': SUITS[card_suit(card)], 'rank': RANKS[card_rank(card)]}
+
+
+def card_from_dict(card):
+    """Returns the card for a {'suit': ..., 'rank': ...} dict"""
+    return make_card(SUITS.index(card['suit']), rank_index(card['rank']))
+
+
+def format_cards(cards):
+    """Returns the string form of a list of cards used by the forms"""
+    return str([card_to_dict(card) for card in cards])
+
+
+def pack_cards(cards):
+    """Returns a list of cards packed as a version byte and one byte a card"""
+    return bytes(bytearray([PACKED_VERSION] + list(cards)))
+
+
+def unpack_cards(data):
+    """Returns the list of cards of packed data. Card lists written as JSON
+    lists of dicts before the compact encoding are converted.
+    Raises ValueError for an unknown format."""
+    data = bytearray(data)
+    if not data:
+        return []
+
+    if data[0] == PACKED_VERSION:
+        return list(data[1:])
+    elif data[0] == JSON_MARKER:
+        return [card_from_dict(card)
+                for card in json.loads(data.decode('utf-8'))]
+    else:
+        raise ValueError('Unknown card list format {}'.format(data[0]))
+
+
+class Hand(object):
+    """A hand of cards indexed by rank, so checking for a rank, taking a card
+    of a rank and adding a card are O(1)."""
+    __slots__ = ('_by_rank', '_size')
+
+    def __init__(self, cards=()):
+        self._by_rank = {}
+        self._size = 0
+        for card in cards:
+            self.add(card)
+
+    def add(self, card):
+        """Adds a card to the hand"""
+        self._by_rank.setdefault(card_rank(card), []).append(card)
+        self._size += 1
+
+    def has_rank(self, rank):
+        """Returns True if the hand holds a card of rank"""
+        return rank in self._by_rank
+
+    def take(self, rank):
+        """Removes and returns a card of rank.
+        Raises KeyError if the hand has no card of rank."""
+        cards = self._by_rank[rank]
+        card = cards.pop()
+        if not cards:
+            del self._by_rank[rank]
+        self._size -= 1
+        return card
+
+    def remove_pairs(self):
+        """Removes every pair of cards of the same rank from the hand.
+        Returns the removed cards, two for each pair."""
+        removed = []
+        for rank in list(self._by_rank):
+            cards = self._by_rank[rank]
+            while len(cards) >= 2:
+                removed.append(cards.pop())
+                removed.append(cards.pop())
+            if not cards:
+                del self._by_rank[rank]
+
+        self._size -= len(removed)
+        return removed
+
+    def cards(self):
+        """Returns the cards of the hand ordered by rank"""
+        return [card for rank in sorted(self._by_rank)
+                for card in self._by_rank[rank]]
+
+    def __iter__(self):
+        return iter(self.cards())
+
+    def __len__(self):
+        return self._size
+
+    def __eq__(self, other):
+        return (isinstance(other, Hand) and
+                sorted(self.cards()) == sorted(other.cards()))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Hand({!r})'.format(self.cards())
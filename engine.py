@@ -0,0 +1,195 @@
+"""engine.py - The Go Fish rules on plain in-memory state. Nothing here
+touches the datastore, so the rules can be run, benchmarked and simulated on
+their own. models.game.Game maps its entities to and from this state."""
+
+import random
+
+from cards import DECK_SIZE, Hand, rank_index
+
+# kinds of Event
+NOT_YOUR_TURN = 'not_your_turn'
+MISSING_RANK = 'missing_rank'
+MATCH = 'match'
+GO_FISH = 'go_fish'
+GAME_OVER = 'game_over'
+
+
+def new_seed():
+    """Returns a random seed for a game's deck shuffle"""
+    return random.SystemRandom().randint(0, 2 ** 32 - 1)
+
+
+class Deck(object):
+    """A deck shuffled once when created. Cards are dealt and drawn from the
+    end of the list so each card costs O(1)."""
+    __slots__ = ('rng', 'deck')
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+        self.deck = []
+
+    def create_deck(self):
+        self.deck = list(range(DECK_SIZE))
+        self.rng.shuffle(self.deck)
+
+    def deal_hand(self, cards_to_deal):
+        hand = []
+        for i in range(cards_to_deal):
+            hand.append(self.deck.pop())
+        return hand
+
+
+class PlayerState(object):
+    """A player's hand, matched cards and guessed ranks"""
+    __slots__ = ('name', 'hand', 'matches', 'num_matches', 'history')
+
+    def __init__(self, name, hand=None, matches=None, num_matches=0,
+                 history=None):
+        self.name = name
+        self.hand = hand if hand is not None else Hand()
+        self.matches = matches if matches is not None else []
+        self.num_matches = num_matches
+        self.history = history if history is not None else []
+
+    def check_pairs(self):
+        """Moves every pair in the hand to matches"""
+        pairs = self.hand.remove_pairs()
+        self.matches.extend(pairs)
+        self.num_matches += len(pairs) // 2
+
+    def check_game_over(self, matches_to_win):
+        """Returns True if the player is out of cards or has enough
+        matches"""
+        return len(self.hand) == 0 or self.num_matches >= matches_to_win
+
+
+class GameState(object):
+    """Both players, the deck and whose turn it is. The deck is drawn from
+    the end of the list."""
+    __slots__ = ('players', 'deck', 'turn', 'matches_to_win', 'game_over',
+                 'winner', 'loser')
+
+    def __init__(self, players, deck, turn, matches_to_win, game_over=False,
+                 winner=None, loser=None):
+        self.players = players
+        self.deck = deck
+        self.turn = turn
+        self.matches_to_win = matches_to_win
+        self.game_over = game_over
+        self.winner = winner
+        self.loser = loser
+
+    def player(self, name):
+        """Returns the PlayerState of name.
+        Raises KeyError if name is not in the game."""
+        for player in self.players:
+            if player.name == name:
+                return player
+        raise KeyError(name)
+
+    def opponent(self, name):
+        """Returns the PlayerState of the other player"""
+        player1, player2 = self.players
+        return player2 if player1.name == name else player1
+
+
+class Event(object):
+    """Something a move did. player is the name of the player it concerns,
+    rank and card are set where they apply."""
+    __slots__ = ('kind', 'player', 'rank', 'card')
+
+    def __init__(self, kind, player, rank=None, card=None):
+        self.kind = kind
+        self.player = player
+        self.rank = rank
+        self.card = card
+
+    def __repr__(self):
+        return 'Event({!r}, {!r}, {!r}, {!r})'.format(
+            self.kind, self.player, self.rank, self.card)
+
+
+def deal(names, cards_dealt, matches_to_win, seed):
+    """Returns the GameState of a new game between two players. The deck is
+    shuffled with a random.Random seeded by seed, so a seed always deals the
+    same hands. The first player has the first turn. A game can end on the
+    deal, then the state is already over."""
+    deck = Deck(random.Random(seed))
+    deck.create_deck()
+
+    players = []
+    for name in names:
+        player = PlayerState(name, Hand(deck.deal_hand(cards_dealt)))
+        player.check_pairs()
+        players.append(player)
+
+    state = GameState(players, deck.deck, names[0], matches_to_win)
+
+    player1, player2 = players
+    if player1.check_game_over(matches_to_win):
+        _end_game(state, player1, player2)
+    elif player2.check_game_over(matches_to_win):
+        _end_game(state, player2, player1)
+
+    return state
+
+
+def apply_move(state, name, guess):
+    """Applies the guess of a rank name from cards.RANKS by the player name.
+    The state is updated in place. A guess out of turn or of a rank the
+    player doesn't hold changes nothing.
+    Returns:
+        The state and the list of Events of the move.
+    Raises:
+        ValueError if the game is over or guess is not a rank name."""
+    if state.game_over:
+        raise ValueError('Game is already over')
+
+    rank = rank_index(guess)
+
+    if name != state.turn:
+        return state, [Event(NOT_YOUR_TURN, name, rank)]
+
+    player = state.player(name)
+    opponent = state.opponent(name)
+
+    if not player.hand.has_rank(rank):
+        return state, [Event(MISSING_RANK, name, rank)]
+
+    player.history.append(guess)
+
+    if opponent.hand.has_rank(rank):
+        # move a card of the rank from both hands to player matches
+        player.matches.append(player.hand.take(rank))
+        player.matches.append(opponent.hand.take(rank))
+        player.num_matches += 1
+
+        events = [Event(MATCH, name, rank)]
+        if player.check_game_over(state.matches_to_win):
+            events.append(_end_game(state, player, opponent))
+        elif opponent.check_game_over(state.matches_to_win):
+            events.append(_end_game(state, opponent, player))
+        return state, events
+
+    # go fish, the turn passes even if the deck is empty
+    card = None
+    if state.deck:
+        card = state.deck.pop()
+        player.hand.add(card)
+        player.check_pairs()
+
+    state.turn = opponent.name
+    events = [Event(GO_FISH, name, rank, card)]
+
+    # pairs in the drawn card can empty the hand or reach the target
+    if player.check_game_over(state.matches_to_win):
+        events.append(_end_game(state, player, opponent))
+    return state, events
+
+
+def _end_game(state, winner, loser):
+    state.game_over = True
+    state.turn = None
+    state.winner = winner.name
+    state.loser = loser.name
+    return Event(GAME_OVER, winner.name)
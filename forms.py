@@ -16,11 +16,23 @@ class GameForm(messages.Message):
     winner = messages.StringField(11, required=False)
     started_on = message_types.DateTimeField(12, required=True)
     matches_to_win = messages.IntegerField(13, required=True)
+    version = messages.IntegerField(14, required=False)
+
+
+class GameSummaryForm(messages.Message):
+    """GameSummaryForm for compact game listings"""
+    urlsafe_key = messages.StringField(1, required=True)
+    players = messages.StringField(2, repeated=True)
+    turn = messages.StringField(3, required=False)
+    game_over = messages.BooleanField(4, required=True)
+    winner = messages.StringField(5, required=False)
 
 
 class AllGamesForm(messages.Message):
     """Returns all games data"""
     games = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2, required=False)
+    summaries = messages.MessageField(GameSummaryForm, 3, repeated=True)
 
 
 class UserScoreForm(messages.Message):
@@ -35,6 +47,7 @@ class UserScoreForm(messages.Message):
 class AllUserScores(messages.Message):
     """Repeated UserScoreForm"""
     scores = messages.MessageField(UserScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2, required=False)
 
 
 class UserGameForm(messages.Message):
@@ -55,6 +68,7 @@ class MoveForm(messages.Message):
     hand = messages.StringField(3, required=False)
     num_matches = messages.IntegerField(4, required=False)
     game_over = messages.BooleanField(5, required=True)
+    version = messages.IntegerField(6, required=False)
 
 
 class PlayerHandForm(messages.Message):
@@ -72,6 +86,7 @@ class StringMessage(messages.Message):
 class StringRepeatedMessage(messages.Message):
     """StringMessage-- outbound (multiple) string messages"""
     messages = messages.StringField(1, repeated=True)
+    next_cursor = messages.StringField(2, required=False)
 
 
 class GameHistoryForm(messages.Message):
@@ -86,3 +101,36 @@ class GameHistoryForm(messages.Message):
 class AllGameHistory(messages.Message):
     """Returns all GameHistoryForm"""
     history = messages.MessageField(GameHistoryForm, 1, repeated=True)
+    next_cursor = messages.StringField(2, required=False)
+
+
+class StatForm(messages.Message):
+    """StatForm for a single named counter"""
+    name = messages.StringField(1, required=True)
+    value = messages.IntegerField(2, required=True)
+
+
+class StatsForm(messages.Message):
+    """Returns repeated StatForm"""
+    stats = messages.MessageField(StatForm, 1, repeated=True)
+
+
+class CallStatsForm(messages.Message):
+    """CallStatsForm for the totals of an instrumented endpoint or handler"""
+    name = messages.StringField(1, required=True)
+    calls = messages.IntegerField(2, required=True)
+    errors = messages.IntegerField(3, required=True)
+    wall_ms = messages.IntegerField(4, required=True)
+    datastore_get = messages.IntegerField(5, required=True)
+    datastore_put = messages.IntegerField(6, required=True)
+    datastore_delete = messages.IntegerField(7, required=True)
+    datastore_query = messages.IntegerField(8, required=True)
+    datastore_count = messages.IntegerField(9, required=True)
+    memcache_hit = messages.IntegerField(10, required=True)
+    memcache_miss = messages.IntegerField(11, required=True)
+    tasks = messages.IntegerField(12, required=True)
+
+
+class AllCallStats(messages.Message):
+    """Returns repeated CallStatsForm"""
+    calls = messages.MessageField(CallStatsForm, 1, repeated=True)
@@ -0,0 +1,92 @@
+"""game_cache.py - Write-through memcache snapshots of live games. A snapshot
+holds a Game and both of its Players under the game's urlsafe key, so reading
+a live game costs one memcache get."""
+
+import logging
+
+from google.appengine.api import memcache
+
+from models.game import Game
+from utils import get_by_urlsafe
+
+SNAPSHOT_PREFIX = 'game_snapshot:'
+
+# seconds without a move before a snapshot is evicted
+SNAPSHOT_TTL = 60 * 60
+
+METRIC_PREFIX = 'game_cache:'
+METRICS = ('hits', 'misses', 'stores', 'evictions')
+
+
+def load_game(urlsafe_key):
+    """Returns the Game a urlsafe key points to with its Players attached.
+        A live game is served from its snapshot, or read from the datastore
+        and snapshotted on a miss.
+    Args:
+        urlsafe_key: A urlsafe Game key string
+    Returns:
+        The Game or None if no entity exists."""
+    snapshot = memcache.get(SNAPSHOT_PREFIX + urlsafe_key)
+    if snapshot is not None and snapshot['game'] is not None:
+        _count('hits')
+        game = snapshot['game']
+        game._players = snapshot['players']
+        return game
+
+    _count('misses')
+    game = get_by_urlsafe(urlsafe_key, Game)
+    # an evicted game is not snapshotted again
+    if game and not game.game_over and snapshot is None:
+        store_game(game)
+
+    return game
+
+
+def store_game(game):
+    """Writes the snapshot of a live game after a committed change. A
+    snapshot is never replaced by one with an older game version, and an
+    evicted game is never snapshotted again."""
+    key = SNAPSHOT_PREFIX + game.key.urlsafe()
+    snapshot = {'version': game.version,
+                'game': game,
+                'players': game.get_players()}
+
+    client = memcache.Client()
+    for _ in range(3):
+        current = client.gets(key)
+        if current is None:
+            stored = client.add(key, snapshot, time=SNAPSHOT_TTL)
+        elif current['game'] is None or current['version'] >= game.version:
+            return
+        else:
+            stored = client.cas(key, snapshot, time=SNAPSHOT_TTL)
+
+        if stored:
+            _count('stores')
+            return
+    logging.warning('Unable to store the snapshot of game %s', key)
+
+
+def evict_game(urlsafe_key, version=None):
+    """Replaces the snapshot of a game that ended or was cancelled with a
+    tombstone. Until the tombstone expires, a writer still holding an older
+    version of the game can't add its snapshot back.
+    Args:
+        urlsafe_key: A urlsafe Game key string
+        version: The final version of the game, if it still exists"""
+    memcache.set(SNAPSHOT_PREFIX + urlsafe_key,
+                 {'version': version, 'game': None, 'players': None},
+                 time=SNAPSHOT_TTL)
+    _count('evictions')
+
+
+def get_cache_counts():
+    """Returns a dict of game cache counters"""
+    counts = memcache.get_multi(METRICS, key_prefix=METRIC_PREFIX)
+    return dict((name, counts.get(name, 0)) for name in METRICS)
+
+
+def _count(name):
+    """Increments a game cache counter"""
+    if memcache.incr(METRIC_PREFIX + name, initial_value=0) is None:
+        logging.warning('Unable to increment cache counter %s', name)
@@ -0,0 +1,155 @@
+"""instrumentation.py - Per request RPC and latency stats. Endpoints and task
+handlers wrapped with instrumented count their datastore, memcache and task
+queue calls through apiproxy hooks, log one structured line per call and add
+the counts to memcache totals per endpoint."""
+
+import functools
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map, memcache
+
+STATS_PREFIX = 'rpc_stats:'
+NAMES_KEY = 'rpc_stats_names'
+
+# seconds before a process checks again that a name it added is still in
+# the memcache name list, which an eviction can drop
+NAMES_CHECK_INTERVAL = 60
+
+COUNTERS = ('calls', 'errors', 'wall_ms', 'datastore_get', 'datastore_put',
+            'datastore_delete', 'datastore_query', 'datastore_count',
+            'memcache_hit', 'memcache_miss', 'tasks')
+
+DATASTORE_COUNTERS = {
+    'Get': 'datastore_get',
+    'Put': 'datastore_put',
+    'Delete': 'datastore_delete',
+}
+
+_local = threading.local()
+
+# name: time this process last found it in the memcache name list
+_known_names = {}
+
+
+def instrumented(func):
+    """Decorates an endpoint method or handler method to record its wall
+    time and API calls. The name recorded is the class and method name,
+    e.g. GoFishApi.make_move. Place it below @endpoints.method."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        name = '{}.{}'.format(type(self).__name__, func.__name__)
+        stats = dict.fromkeys(COUNTERS, 0)
+        stats['calls'] = 1
+
+        active = _active()
+        active.append(stats)
+        start = time.time()
+        try:
+            return func(self, *args, **kwargs)
+        except Exception:
+            stats['errors'] = 1
+            raise
+        finally:
+            stats['wall_ms'] = int((time.time() - start) * 1000)
+            active.remove(stats)
+            _record(name, stats)
+
+    return wrapper
+
+
+def get_call_totals():
+    """Returns {name: {counter: total}} of every instrumented call seen"""
+    names = memcache.get(NAMES_KEY) or []
+    keys = ['{}:{}'.format(name, counter)
+            for name in names for counter in COUNTERS]
+    totals = memcache.get_multi(keys, key_prefix=STATS_PREFIX)
+
+    return dict((name, dict((counter, totals.get(
+                 '{}:{}'.format(name, counter), 0)) for counter in COUNTERS))
+                for name in names)
+
+
+def _active():
+    """Returns the stats of the instrumented calls running in this thread"""
+    if not hasattr(_local, 'active'):
+        _local.active = []
+    return _local.active
+
+
+def _record(name, stats):
+    """Logs the stats of a call and adds them to the memcache totals"""
+    logging.info('rpc_stats %s', json.dumps(dict(stats, name=name),
+                                            sort_keys=True))
+
+    memcache.offset_multi(
+        dict(('{}:{}'.format(name, counter), value)
+             for counter, value in stats.items() if value),
+        key_prefix=STATS_PREFIX, initial_value=0)
+
+    now = time.time()
+    if now - _known_names.get(name, 0) > NAMES_CHECK_INTERVAL:
+        _add_name(name)
+        _known_names[name] = now
+
+
+def _add_name(name):
+    """Adds name to the list of instrumented names in memcache"""
+    client = memcache.Client()
+    for _ in range(3):
+        names = client.gets(NAMES_KEY)
+        if names is None:
+            if client.add(NAMES_KEY, [name]):
+                return
+            continue
+        if name in names:
+            return
+        if client.cas(NAMES_KEY, names + [name]):
+            return
+    logging.warning('Unable to add %s to the instrumented names', name)
+
+
+def _count(counter, amount=1):
+    for stats in _active():
+        stats[counter] += amount
+
+
+def _pre_call_hook(service, call, request, response):
+    """Counts datastore and task queue calls of instrumented calls"""
+    if not _active():
+        return
+
+    if service == 'datastore_v3':
+        if call in DATASTORE_COUNTERS:
+            _count(DATASTORE_COUNTERS[call])
+        elif call == 'RunQuery':
+            # count() runs a query that skips the results with limit 0
+            if request.has_limit() and request.limit() == 0:
+                _count('datastore_count')
+            else:
+                _count('datastore_query')
+
+    elif service == 'taskqueue':
+        if call == 'BulkAdd':
+            _count('tasks', request.add_request_size())
+        elif call == 'Add':
+            _count('tasks')
+
+
+def _post_call_hook(service, call, request, response):
+    """Counts memcache hits and misses of instrumented calls"""
+    if service != 'memcache' or call != 'Get' or not _active():
+        return
+
+    hits = response.item_size()
+    _count('memcache_hit', hits)
+    _count('memcache_miss', request.key_size() - hits)
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'instrumentation', _pre_call_hook)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'instrumentation', _post_call_hook)
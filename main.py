@@ -2,55 +2,443 @@
 
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
+import csv
+import json
 import logging
+from datetime import datetime, timedelta
 
 import webapp2
 from google.appengine.ext import ndb
-from google.appengine.api import mail, app_identity
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.api import (
+    mail, app_identity, taskqueue, datastore_errors)
 from api import GoFishApi
+from game_cache import evict_game
+from instrumentation import instrumented
+from migrations import MIGRATIONS
 
+from models.archived_game import ArchivedGame
+from models.bulk_job import BulkJob
+from models.migration import Migration
+from models.reminder import Reminder
 from models.user import User
-from models.game import Game
+from models.game import Game, LAYOUT_EMBEDDED
+
+ARCHIVE_BATCH_SIZE = 50
+REMINDER_SCAN_SIZE = 1000
+REMINDER_BATCH_SIZE = 100
+STALE_SCAN_SIZE = 500
+STALE_BATCH_SIZE = 50
+DEFAULT_IDLE_DAYS = 30
+# passes of ScanStaleGames
+SCAN_UPDATED = 'updated'
+SCAN_STARTED = 'started'
+EXPORT_PAGE_SIZE = 100
+MAX_EXPORT_PAGE_SIZE = 1000
+EXPORT_FIELDS = ('game', 'index', 'player', 'time', 'guess', 'match',
+                 'game_over')
 
 
 class SendReminderEmail(webapp2.RequestHandler):
 
+    @instrumented
     def get(self):
-        """Send a reminder email to each User with an email about games.
-        Called every hour using a cron job"""
+        """Fan out reminder emails to each User with an active game.
+        Called every 24 hours using a cron job. One keys-only pass over
+        users with active games collects the players, then the emails are
+        sent in batches by SendReminderBatch tasks. Until the
+        index_active_games migration has filled User.active_games, the
+        players are collected from an index-only pass over active games."""
+        day = datetime.utcnow().strftime('%Y-%m-%d')
+
+        if Migration.is_done('index_active_games'):
+            keys = User.query(User.active_games > None).iter(
+                keys_only=True, batch_size=REMINDER_SCAN_SIZE)
+            param = 'user'
+            recipients = sorted(key.urlsafe() for key in keys)
+        else:
+            param = 'name'
+            recipients = sorted(self._active_player_names())
+
+        # batches may differ between cron retries, duplicates are caught by
+        # the per user Reminder claim instead of task names
+        for index in xrange(0, len(recipients), REMINDER_BATCH_SIZE):
+            taskqueue.add(
+                url='/tasks/send_reminders',
+                params={'day': day,
+                        param: recipients[index:index + REMINDER_BATCH_SIZE]})
+
+        logging.info('Scheduled reminders for %d players', len(recipients))
+
+    @staticmethod
+    def _active_player_names():
+        """Returns the set of player names of every active game"""
+        names = set()
+        cursor = None
+        more = True
+        while more:
+            games, cursor, more = Game.query(
+                Game.game_over == False).fetch_page(
+                    REMINDER_SCAN_SIZE, start_cursor=cursor,
+                    projection=[Game.player_names])
+
+            # a projection returns one result per player name
+            for game in games:
+                names.update(game.player_names)
+
+        return names
+
+
+class SendReminderBatch(webapp2.RequestHandler):
+
+    @instrumented
+    def post(self):
+        """Send the reminder email to a batch of players, given by urlsafe
+        User keys or by names. Each user is claimed with a Reminder for the
+        day first, so a retried task or cron never sends twice. A claim
+        whose email fails is released and the task fails, so its retry
+        sends the email."""
         app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
+        day = self.request.get('day')
+        keys = [ndb.Key(urlsafe=urlsafe)
+                for urlsafe in self.request.get_all('user')]
+        names = self.request.get_all('name')
 
-        # check to see if any users have emails
-        if users.count():
-            for user in users:
+        users = ndb.get_multi(keys + [User.key_for(name) for name in names])
+        for name, user in zip([None] * len(keys) + names, users):
+            if user is None and name:
+                user = User.get_by_name(name)
 
-                # retrieve games of the player that are not over
-                game = Game.query(ndb.AND(Game.game_over == False,
-                                          Game.player_names.IN([user.name])))
+            if not user or not user.email:
+                continue
 
-                if game.count():
-                    subject = 'This is a reminder that you have an active game!'
-                    body = 'Hello {}, you have an active game going!'.format(
-                        user.name)
+            if not Reminder.claim(user.name, day):
+                continue
 
-                    # This will send test emails, the arguments to send_mail are:
-                    # from, to, subject, body
-                    mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                                   user.email,
-                                   subject,
-                                   body)
+            subject = 'This is a reminder that you have an active game!'
+            body = 'Hello {}, you have an active game going!'.format(
+                user.name)
+
+            # This will send test emails, the arguments to send_mail are:
+            # from, to, subject, body
+            try:
+                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
+                               user.email,
+                               subject,
+                               body)
+            except Exception:
+                Reminder.release(user.name, day)
+                raise
+
+        self.response.set_status(204)
 
 
 class UpdateScoreboard(webapp2.RequestHandler):
 
+    @instrumented
+    def get(self):
+        """Reconcile the scoreboard. Called every 6 hours using a cron job"""
+        GoFishApi._cache_scoreboard()
+        self.response.set_status(204)
+
+    @instrumented
     def post(self):
-        """Update game listing announcement in memcache."""
+        """Reconcile the scoreboard from a task queue."""
         GoFishApi._cache_scoreboard()
         self.response.set_status(204)
 
 
+class ArchiveGames(webapp2.RequestHandler):
+
+    @instrumented
+    def get(self):
+        """Archive finished games. Called every hour using a cron job"""
+        self.post()
+
+    @instrumented
+    def post(self):
+        """Move one batch of finished Games to ArchivedGame, so queries on
+        live games don't scan them. Enqueues itself until none are left. A
+        full batch of stale index results that archives nothing ends the
+        chain, the next cron run picks up what is left."""
+        keys = Game.query(Game.game_over == True).fetch(
+            ARCHIVE_BATCH_SIZE, keys_only=True)
+
+        archived = len([key for key in keys if ArchivedGame.archive(key)])
+
+        logging.info('Archived %d of %d games', archived, len(keys))
+        if archived and len(keys) == ARCHIVE_BATCH_SIZE:
+            taskqueue.add(url='/tasks/archive_games')
+
+        self.response.set_status(204)
+
+
+class RunMigration(webapp2.RequestHandler):
+
+    @instrumented
+    def post(self):
+        """Run one batch of a migration from migrations.MIGRATIONS. Each task
+        enqueues the next batch, then the next step, until the migration is
+        done. Start it by adding a task to /tasks/migrate with the migration
+        name as the migration param."""
+        name = self.request.get('migration')
+        steps = MIGRATIONS[name]
+        index = int(self.request.get('step', 0))
+
+        cursor = self.request.get('cursor')
+        cursor = steps[index](Cursor(urlsafe=cursor) if cursor else None)
+
+        if cursor:
+            taskqueue.add(url='/tasks/migrate',
+                          params={'migration': name,
+                                  'step': index,
+                                  'cursor': cursor.urlsafe()})
+        elif index + 1 < len(steps):
+            taskqueue.add(url='/tasks/migrate',
+                          params={'migration': name, 'step': index + 1})
+        else:
+            Migration.mark_done(name)
+            logging.info('Migration %s finished', name)
+
+        self.response.set_status(204)
+
+
+class CancelStaleGames(webapp2.RequestHandler):
+
+    @instrumented
+    def post(self):
+        """Start a job that cancels every live game not played for
+        idle_days days (default 30). Responds with the job's progress, which
+        is polled at /admin/jobs/<job_id>."""
+        try:
+            idle_days = int(self.request.get('idle_days', DEFAULT_IDLE_DAYS))
+        except ValueError:
+            self.abort(400, 'idle_days must be a number')
+        if idle_days < 1:
+            self.abort(400, 'idle_days must be at least 1')
+
+        cutoff = datetime.utcnow() - timedelta(days=idle_days)
+        job = BulkJob(name='cancel_stale_games', cutoff=cutoff)
+        job.put()
+
+        taskqueue.add(url='/tasks/scan_stale_games',
+                      name='job-{}-scan-0'.format(job.key.id()),
+                      params={'job_id': job.key.id(), 'page': 0})
+
+        logging.info('Cancelling games idle since %s, job %d',
+                     cutoff, job.key.id())
+        self.response.set_status(202)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(job.to_dict()))
+
+
+class BulkJobStatus(webapp2.RequestHandler):
+
+    @instrumented
+    def get(self, job_id):
+        """Return the progress and throughput of a BulkJob as JSON"""
+        job = BulkJob.get_by_id(int(job_id))
+        if not job:
+            self.abort(404)
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(job.to_dict()))
+
+
+class ScanStaleGames(webapp2.RequestHandler):
+
+    @instrumented
+    def post(self):
+        """Fan one page of idle games out to CancelGamesBatch tasks and
+        enqueue the scan of the next page. Tasks are named by job and page,
+        so a retried scan never enqueues a batch twice. Games not written
+        since updated_on was added have no value to filter on, so a second
+        pass scans the live games started before the cutoff and the batches
+        skip those played since."""
+        job_key = ndb.Key(BulkJob, int(self.request.get('job_id')))
+        page = int(self.request.get('page'))
+        phase = self.request.get('phase', SCAN_UPDATED)
+        job = job_key.get()
+
+        if phase == SCAN_UPDATED:
+            query = Game.query(Game.game_over == False,
+                               Game.updated_on < job.cutoff)
+        else:
+            query = Game.query(Game.game_over == False,
+                               Game.started_on < job.cutoff)
+
+        cursor = self.request.get('cursor')
+        keys, cursor, more = query.fetch_page(
+            STALE_SCAN_SIZE,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None,
+            keys_only=True)
+
+        tasks = []
+        for index in xrange(0, len(keys), STALE_BATCH_SIZE):
+            name = 'job-{}-page-{}-batch-{}'.format(
+                job_key.id(), page, index // STALE_BATCH_SIZE)
+            tasks.append(taskqueue.Task(
+                url='/tasks/cancel_games',
+                name=name,
+                params={'job_id': job_key.id(),
+                        'batch': name,
+                        'game': [key.urlsafe()
+                                 for key in keys[index:index +
+                                                 STALE_BATCH_SIZE]]}))
+
+        # the page is counted before its batches run, so batches_done can't
+        # catch up with batches before the scan is over
+        BulkJob.record_page(job_key, page, len(keys), len(tasks),
+                            not more and phase == SCAN_STARTED)
+
+        if more or phase == SCAN_UPDATED:
+            params = {'job_id': job_key.id(), 'page': page + 1}
+            if more:
+                params.update(phase=phase, cursor=cursor.urlsafe())
+            else:
+                params.update(phase=SCAN_STARTED)
+            tasks.append(taskqueue.Task(
+                url='/tasks/scan_stale_games',
+                name='job-{}-scan-{}'.format(job_key.id(), page + 1),
+                params=params))
+
+        if tasks:
+            try:
+                taskqueue.Queue().add(tasks)
+            except taskqueue.TaskAlreadyExistsError:
+                logging.info('Page %d of job %d was already enqueued',
+                             page, job_key.id())
+
+        self.response.set_status(204)
+
+
+class CancelGamesBatch(webapp2.RequestHandler):
+
+    @instrumented
+    def post(self):
+        """Cancel a batch of idle games, each in its own transaction, and add
+        the counts to the job. Games played since the job started are
+        skipped."""
+        job_key = ndb.Key(BulkJob, int(self.request.get('job_id')))
+        job = job_key.get()
+
+        processed = skipped = 0
+        for urlsafe in self.request.get_all('game'):
+            if Game.cancel_if_idle(ndb.Key(urlsafe=urlsafe), job.cutoff):
+                evict_game(urlsafe)
+                processed += 1
+            else:
+                skipped += 1
+
+        job = BulkJob.record_batch(job_key, self.request.get('batch'),
+                                   processed, skipped)
+
+        logging.info('Cancelled %d idle games, skipped %d, job %d at %s '
+                     'games/s', processed, skipped, job_key.id(),
+                     job.to_dict()['per_second'])
+        self.response.set_status(204)
+
+
+class ExportMoves(webapp2.RequestHandler):
+
+    @instrumented
+    def get(self):
+        """Export the move logs of a page of games, one row per move.
+        Params:
+            format: 'ndjson' (default) for one JSON object per line or 'csv'
+            archived: set to export ArchivedGames instead of live games
+            games: number of games in the page, default 100, at most 1000
+            cursor: X-Next-Cursor header of the previous page
+        Games and moves are read with query iterators and every row is
+        written as soon as it is read. App Engine buffers the response, so an
+        export is split into pages of games and memory is bounded by the page
+        instead of the export. Request the next page with X-Next-Cursor until
+        it is missing."""
+        export_format = self.request.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            self.abort(400, 'format must be ndjson or csv')
+
+        try:
+            page_size = min(int(self.request.get('games', EXPORT_PAGE_SIZE)),
+                            MAX_EXPORT_PAGE_SIZE)
+            cursor = self.request.get('cursor')
+            cursor = Cursor(urlsafe=cursor) if cursor else None
+        except (ValueError, datastore_errors.BadValueError):
+            self.abort(400, 'Invalid games or cursor')
+        if page_size < 1:
+            self.abort(400, 'games must be at least 1')
+
+        if self.request.get('archived'):
+            query, rows = ArchivedGame.query(), _archived_move_rows
+        else:
+            query, rows = Game.query(), _move_rows
+
+        games = query.iter(start_cursor=cursor, produce_cursors=True,
+                           batch_size=min(page_size, EXPORT_PAGE_SIZE))
+
+        if export_format == 'csv':
+            self.response.headers['Content-Type'] = 'text/csv'
+            writer = csv.writer(self.response.out)
+            writer.writerow(EXPORT_FIELDS)
+            write = lambda row: writer.writerow(
+                [row[field] for field in EXPORT_FIELDS])
+        else:
+            self.response.headers['Content-Type'] = 'application/x-ndjson'
+            write = lambda row: self.response.out.write(
+                json.dumps(row, sort_keys=True) + '\n')
+
+        count = 0
+        for game in games:
+            for row in rows(game):
+                write(row)
+            count += 1
+            if count == page_size:
+                break
+
+        if count == page_size and games.has_next():
+            self.response.headers['X-Next-Cursor'] = \
+                games.cursor_after().urlsafe()
+
+
+def _move_rows(game):
+    """Yields an export row for each move of a live game in move order"""
+    urlsafe = game.key.urlsafe()
+    if game.layout == LAYOUT_EMBEDDED:
+        moves = game.move_log
+    else:
+        moves = game.move_query().iter()
+
+    for index, move in enumerate(moves):
+        yield {'game': urlsafe,
+               'index': index,
+               'player': move.name,
+               'time': move.time.isoformat(),
+               'guess': move.guess,
+               'match': move.match,
+               'game_over': move.game_over}
+
+
+def _archived_move_rows(archived):
+    """Yields an export row for each move of an ArchivedGame"""
+    for index, move in enumerate(archived.moves or []):
+        yield {'game': archived.key.id(),
+               'index': index,
+               'player': move['name'],
+               'time': move['time'],
+               'guess': move['guess'],
+               'match': move['match'],
+               'game_over': move['game_over']}
+
+
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    ('/tasks/send_reminders', SendReminderBatch),
     ('/tasks/cache_scoreboard', UpdateScoreboard),
+    ('/tasks/archive_games', ArchiveGames),
+    ('/tasks/migrate', RunMigration),
+    ('/tasks/scan_stale_games', ScanStaleGames),
+    ('/tasks/cancel_games', CancelGamesBatch),
+    ('/admin/cancel_stale_games', CancelStaleGames),
+    (r'/admin/jobs/(\d+)', BulkJobStatus),
+    ('/admin/export/moves', ExportMoves),
 ], debug=True)
@@ -0,0 +1,214 @@
+"""migrations.py - Batched data migrations run from the task queue."""
+
+import logging
+
+from google.appengine.ext import ndb
+
+from models.game import Game, LAYOUT_EMBEDDED, LAYOUT_PLAYERS
+from models.move import Move
+from models.player import Player
+from models.user import User
+
+MIGRATION_BATCH_SIZE = 100
+
+
+def rekey_users(cursor=None):
+    """Moves one batch of Users to keys derived from their normalized name.
+    The Players pointing at them are updated by repoint_players, which runs
+    after every User has moved.
+    Args:
+        cursor: ndb Cursor to resume from, None for the first batch
+    Returns:
+        The Cursor for the next batch or None when done."""
+    users, cursor, more = User.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+    moved = 0
+    for user in users:
+        new_key = User.key_for(user.name)
+        if user.key == new_key:
+            continue
+
+        _rekey_user(user, new_key)
+        moved += 1
+
+    logging.info('Rekeyed %d of %d users', moved, len(users))
+    return cursor if more else None
+
+
+def repoint_players(cursor=None):
+    """Points the Players of one batch of Games, embedded ones included, at
+    the User key derived from their name. Players are matched by name rather
+    than by the old User key, so a retried batch or a User deleted by an
+    earlier batch can't leave a Player pointing at a missing User.
+    Args:
+        cursor: ndb Cursor to resume from, None for the first batch
+    Returns:
+        The Cursor for the next batch or None when done."""
+    keys, cursor, more = Game.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+    moved = 0
+    for key in keys:
+        if _repoint_game_players(key):
+            moved += 1
+
+    logging.info('Repointed the players of %d of %d games', moved, len(keys))
+    return cursor if more else None
+
+
+def rekey_players(cursor=None):
+    """Moves one batch of Players to keys derived from their game and
+    normalized name. Moves pointing at an old Player key are updated to the
+    new key.
+    Args:
+        cursor: ndb Cursor to resume from, None for the first batch
+    Returns:
+        The Cursor for the next batch or None when done."""
+    players, cursor, more = Player.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+    moved = 0
+    for player in players:
+        new_key = Player.key_for(player.key.parent(), player.name)
+        if player.key == new_key:
+            continue
+
+        _rekey_player(player, new_key)
+        moved += 1
+
+    logging.info('Rekeyed %d of %d players', moved, len(players))
+    return cursor if more else None
+
+
+def resave_games(cursor=None):
+    """Puts one batch of Games again so computed properties added since they
+    were written, such as player1 and player2, are stored and indexed.
+    Args:
+        cursor: ndb Cursor to resume from, None for the first batch
+    Returns:
+        The Cursor for the next batch or None when done."""
+    games, cursor, more = Game.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=cursor)
+    ndb.put_multi(games)
+
+    logging.info('Resaved %d games', len(games))
+    return cursor if more else None
+
+
+def embed_games(cursor=None):
+    """Moves the Players and Moves of one batch of Games into the Game
+    entity, switching them to the embedded layout.
+    Args:
+        cursor: ndb Cursor to resume from, None for the first batch
+    Returns:
+        The Cursor for the next batch or None when done."""
+    keys, cursor, more = Game.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+    moved = 0
+    for key in keys:
+        if _embed_game(key):
+            moved += 1
+
+    logging.info('Embedded %d of %d games', moved, len(keys))
+    return cursor if more else None
+
+
+def index_active_games(cursor=None):
+    """Adds one batch of live Games to their users' active games.
+    Args:
+        cursor: ndb Cursor to resume from, None for the first batch
+    Returns:
+        The Cursor for the next batch or None when done."""
+    games, cursor, more = Game.query(Game.game_over == False).fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+    for game in games:
+        User.add_active_game(
+            [player.user for player in game.get_players() if player],
+            game.key)
+
+    logging.info('Indexed %d active games', len(games))
+    return cursor if more else None
+
+
+# migration name: batch functions run one after the other
+MIGRATIONS = {
+    'rekey': [rekey_users, repoint_players, rekey_players],
+    'resave_games': [resave_games],
+    'embed_games': [embed_games],
+    'index_active_games': [index_active_games],
+}
+
+
+@ndb.transactional
+def _embed_game(key):
+    """Embeds the Players and Moves of a Game and deletes the child
+    entities. Returns False if the game already uses the embedded layout."""
+    game = key.get()
+    if not game or game.layout != LAYOUT_PLAYERS:
+        return False
+
+    players = game.get_players()
+    moves = game.move_query().fetch()
+
+    game.layout = LAYOUT_EMBEDDED
+    game.embedded_players = players
+    game.move_log = moves
+    game.put()
+
+    ndb.delete_multi([player.key for player in players] +
+                     [move.key for move in moves])
+    return True
+
+
+@ndb.transactional(xg=True)
+def _rekey_user(user, new_key):
+    """Copies a User to new_key and deletes the old entity"""
+    if new_key.get():
+        logging.warning('User %s already exists, keeping %s',
+                        new_key.id(), user.key)
+        return
+
+    User(key=new_key, **user.to_dict()).put()
+    user.key.delete()
+
+
+@ndb.transactional
+def _repoint_game_players(key):
+    """Points the Players of a Game at the User keys derived from their
+    names. Returns False if every Player already did."""
+    game = key.get()
+    if not game:
+        return False
+
+    players = [player for player in game.get_players() if player]
+    changed = [player for player in players
+               if player.user != User.key_for(player.name)]
+    if not changed:
+        return False
+
+    for player in changed:
+        player.user = User.key_for(player.name)
+
+    if game.layout == LAYOUT_EMBEDDED:
+        game.put()
+    else:
+        ndb.put_multi(changed)
+    return True
+
+
+@ndb.transactional
+def _rekey_player(player, new_key):
+    """Copies a Player to new_key, repoints its Moves and deletes the old
+    entity. Player and Moves share the game's entity group."""
+    new_player = Player(key=new_key, **player.to_dict())
+
+    moves = [move for move in Move.query(ancestor=new_key.parent())
+             if move.player == player.key]
+    for move in moves:
+        move.player = new_key
+
+    ndb.put_multi([new_player] + moves)
+    player.key.delete()
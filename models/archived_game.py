@@ -0,0 +1,110 @@
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from cards import format_cards
+from forms import GameForm, GameHistoryForm, GameSummaryForm
+from models.game import Game, LAYOUT_EMBEDDED
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class ArchivedGame(ndb.Model):
+    """Compact record of a finished game, keyed by the urlsafe key of the
+    Game it replaced. Players and moves are kept in one compressed blob."""
+    player_names = ndb.StringProperty(repeated=True)
+    winner = ndb.StringProperty()
+    loser = ndb.StringProperty()
+    started_on = ndb.DateTimeProperty(indexed=False)
+    archived_on = ndb.DateTimeProperty(auto_now_add=True)
+    matches_to_win = ndb.IntegerProperty(indexed=False)
+    cards_dealt = ndb.IntegerProperty(indexed=False)
+    players = ndb.JsonProperty(compressed=True)
+    moves = ndb.JsonProperty(compressed=True)
+
+    @classmethod
+    def get_by_urlsafe(cls, urlsafe_key):
+        """Returns the ArchivedGame for a Game's urlsafe key or None"""
+        return cls.get_by_id(urlsafe_key)
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def archive(cls, game_key):
+        """Replaces a finished Game, its Players and Moves with an
+        ArchivedGame. Returns None if the game is gone or not over."""
+        game = game_key.get()
+        if not game or not game.game_over:
+            return None
+
+        if game.layout == LAYOUT_EMBEDDED:
+            moves = game.move_log
+        else:
+            moves = game.move_query().fetch()
+
+        archived = cls(id=game_key.urlsafe(),
+                       player_names=game.player_names,
+                       winner=game.winner,
+                       loser=game.loser,
+                       started_on=game.started_on,
+                       matches_to_win=game.matches_to_win,
+                       cards_dealt=game.cards_dealt)
+
+        archived.players = [{'name': player.name,
+                             'hand': player.hand.cards(),
+                             'matches': list(player.matches),
+                             'num_matches': player.num_matches}
+                            for player in game.get_players()]
+
+        archived.moves = [{'name': move.name,
+                           'time': move.time.strftime(TIME_FORMAT),
+                           'guess': move.guess,
+                           'match': move.match,
+                           'game_over': move.game_over}
+                          for move in moves]
+        archived.put()
+
+        # the game and every child entity
+        ndb.delete_multi(ndb.Query(ancestor=game_key).fetch(keys_only=True))
+        return archived
+
+    def to_form(self, message):
+        """Returns a GameForm representation of the archived game"""
+        player1, player2 = self.players
+
+        form = GameForm()
+        form.started_on = self.started_on
+        form.urlsafe_key = self.key.id()
+        form.player1 = player1['name']
+        form.player1_hand = format_cards(player1['hand'])
+        form.player1_matches = player1['num_matches']
+        form.player2 = player2['name']
+        form.player2_hand = format_cards(player2['hand'])
+        form.player2_matches = player2['num_matches']
+        form.game_over = True
+        form.matches_to_win = self.matches_to_win
+        form.winner = self.winner
+        form.message = message
+        return form
+
+    def to_summary_form(self):
+        """Returns a GameSummaryForm representation of the archived game"""
+        form = GameSummaryForm()
+        form.urlsafe_key = self.key.id()
+        form.players = list(self.player_names)
+        form.game_over = True
+        form.winner = self.winner
+        return form
+
+    def history_forms(self):
+        """Returns a GameHistoryForm for each archived move"""
+        forms = []
+        for move in self.moves:
+            form = GameHistoryForm()
+            form.time = datetime.strptime(move['time'], TIME_FORMAT)
+            form.player = move['name']
+            form.guess = move['guess']
+            form.match = move['match']
+            form.game_over = move['game_over']
+            forms.append(form)
+
+        return forms
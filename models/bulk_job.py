@@ -0,0 +1,93 @@
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+
+class BulkJobBatch(ndb.Model):
+    """Marks a batch of a BulkJob as counted. Child of the job, keyed by the
+    batch name."""
+    processed = ndb.IntegerProperty(indexed=False)
+    skipped = ndb.IntegerProperty(indexed=False)
+
+
+class BulkJob(ndb.Model):
+    """Progress of an admin job that fans out over many games in batches of
+    tasks. The scan task records each page it enqueued and every batch task
+    adds its counts, so the job shows progress and throughput while it
+    runs."""
+    name = ndb.StringProperty(required=True)
+    cutoff = ndb.DateTimeProperty(indexed=False)
+    started_on = ndb.DateTimeProperty(auto_now_add=True)
+    finished_on = ndb.DateTimeProperty(indexed=False)
+    pages = ndb.IntegerProperty(default=0, indexed=False)
+    scan_done = ndb.BooleanProperty(default=False, indexed=False)
+    scanned = ndb.IntegerProperty(default=0, indexed=False)
+    batches = ndb.IntegerProperty(default=0, indexed=False)
+    batches_done = ndb.IntegerProperty(default=0, indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    skipped = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    @ndb.transactional
+    def record_page(cls, job_key, page, scanned, batches, last):
+        """Adds a scanned page and the batches enqueued for it. A retried
+        scan task records its page only once.
+        Returns:
+            The updated BulkJob."""
+        job = job_key.get()
+        if page != job.pages:
+            return job
+
+        job.pages += 1
+        job.scanned += scanned
+        job.batches += batches
+        job.scan_done = last
+        job._check_finished()
+        job.put()
+        return job
+
+    @classmethod
+    @ndb.transactional(retries=8)
+    def record_batch(cls, job_key, batch_name, processed, skipped):
+        """Adds the counts of a finished batch. A retried batch task is
+        counted only once.
+        Returns:
+            The updated BulkJob."""
+        batch_key = ndb.Key(BulkJobBatch, batch_name, parent=job_key)
+        job, batch = ndb.get_multi([job_key, batch_key])
+        if batch:
+            return job
+
+        job.batches_done += 1
+        job.processed += processed
+        job.skipped += skipped
+        job._check_finished()
+        ndb.put_multi([job, BulkJobBatch(key=batch_key,
+                                         processed=processed,
+                                         skipped=skipped)])
+        return job
+
+    def _check_finished(self):
+        if self.scan_done and self.batches_done >= self.batches:
+            self.finished_on = self.finished_on or datetime.utcnow()
+
+    def to_dict(self):
+        """Returns the progress of the job as a JSON serializable dict.
+        per_second is the number of games processed or skipped per second
+        since the job started."""
+        elapsed = ((self.finished_on or datetime.utcnow()) -
+                   self.started_on).total_seconds()
+        done = self.processed + self.skipped
+
+        return {'job_id': self.key.id(),
+                'name': self.name,
+                'cutoff': self.cutoff.isoformat() if self.cutoff else None,
+                'started_on': self.started_on.isoformat(),
+                'finished': self.finished_on is not None,
+                'scanned': self.scanned,
+                'batches': self.batches,
+                'batches_done': self.batches_done,
+                'processed': self.processed,
+                'skipped': self.skipped,
+                'elapsed_seconds': round(elapsed, 3),
+                'per_second': round(done / elapsed, 2) if elapsed else None}
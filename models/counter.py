@@ -0,0 +1,124 @@
+"""counter.py - Sharded counters. A counter is split over shard entities that
+are each their own entity group, so frequent increments of one counter
+don't contend on a single entity. Totals are read from memcache and summed
+from the shards on a miss."""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models.user import User
+
+# global counters
+GAMES_STARTED = 'games_started'
+GAMES_PLAYED = 'games_played'
+ACTIVE_GAMES = 'active_games'
+TOTAL_MOVES = 'total_moves'
+GLOBAL_COUNTERS = (GAMES_STARTED, GAMES_PLAYED, ACTIVE_GAMES, TOTAL_MOVES)
+
+# global counters change with every game, a user's only with their own
+GLOBAL_SHARDS = 20
+USER_SHARDS = 4
+
+CACHE_PREFIX = 'counter:'
+CACHE_TTL = 60
+
+
+class CounterShard(ndb.Model):
+    """One shard of a named counter, keyed by the name and shard index"""
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def wins_counter(username):
+    """Returns the name of a user's wins counter"""
+    return 'wins:' + User.normalize(username)
+
+
+def losses_counter(username):
+    """Returns the name of a user's losses counter"""
+    return 'losses:' + User.normalize(username)
+
+
+def shard_keys(name):
+    """Returns the keys of every shard of a counter"""
+    shards = GLOBAL_SHARDS if name in GLOBAL_COUNTERS else USER_SHARDS
+    return [ndb.Key(CounterShard, '{}:{}'.format(name, index))
+            for index in range(shards)]
+
+
+def increment(name, delta=1):
+    """Adds delta to a random shard of a counter. Called in a transaction the
+    shard is written with it, so the count changes only if the transaction
+    commits. The cached total is updated after the commit."""
+    _add_to_shard(random.choice(shard_keys(name)), delta)
+    ndb.get_context().call_on_commit(lambda: _offset_cached(name, delta))
+
+
+def get_count(name):
+    """Returns the total of a counter"""
+    return get_counts([name])[name]
+
+
+def get_counts(names):
+    """Returns {name: total} of counters. Totals missing from memcache are
+    summed from the shards with one get_multi and cached."""
+    names = list(names)
+    counts = memcache.get_multi(names, key_prefix=CACHE_PREFIX)
+
+    missing = [name for name in names if name not in counts]
+    if missing:
+        keys = [key for name in missing for key in shard_keys(name)]
+        shards = dict(zip(keys, ndb.get_multi(keys)))
+        totals = dict((name, sum(shards[key].count
+                                 for key in shard_keys(name) if shards[key]))
+                      for name in missing)
+        memcache.add_multi(totals, time=CACHE_TTL, key_prefix=CACHE_PREFIX)
+        counts.update(totals)
+
+    return counts
+
+
+def count_shards(name):
+    """Returns the total of a counter summed from its shards, skipping the
+    cached total"""
+    return sum(shard.count for shard in ndb.get_multi(shard_keys(name))
+               if shard)
+
+
+@ndb.transactional(xg=True)
+def add_missing(name, expected):
+    """Adds the difference to its first shard if the total of a counter is
+    below expected. Used by the scoreboard reconciliation to backfill counts
+    from before the counters. A total above expected is left alone, so
+    increments the reconciliation's tally missed are never taken back.
+    Returns True if the counter was changed."""
+    keys = shard_keys(name)
+    shards = ndb.get_multi(keys)
+    total = sum(shard.count for shard in shards if shard)
+    if total >= expected:
+        return False
+
+    first = shards[0] or CounterShard(key=keys[0])
+    first.count += expected - total
+    first.put()
+
+    ndb.get_context().call_on_commit(
+        lambda: memcache.delete(CACHE_PREFIX + name))
+    return True
+
+
+@ndb.transactional
+def _add_to_shard(key, delta):
+    shard = key.get() or CounterShard(key=key)
+    shard.count += delta
+    shard.put()
+
+
+def _offset_cached(name, delta):
+    """Applies delta to a cached total. A total that is not cached is left
+    to be summed from the shards on the next read."""
+    if delta > 0:
+        memcache.incr(CACHE_PREFIX + name, delta)
+    elif delta < 0:
+        memcache.decr(CACHE_PREFIX + name, -delta)
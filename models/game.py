@@ -1,120 +1,142 @@
-from datetime import datetime
-
 from google.appengine.ext import ndb
 
-from forms import GameForm
+from forms import GameForm, GameSummaryForm
 from models.player import Player
 from models.move import Move
+from models.user import User
 
-import json
 import random
 
-suits = {
-    0: "Spades",
-    1: "Clubs",
-    2: "Hearts",
-    3: "Diamonds"
-}
-faces = {
-    11: "Jack",
-    12: "Queen",
-    13: "King",
-    14: "Ace"
-}
-
-
-class Deck(object):
-
-    def __init__(self):
-        self.deck = []
-
-    def create_deck(self):
-        for s in xrange(4):
-            for r in xrange(2, 15):
-                if r > 10:
-                    r = faces[r]
-                card = {
-                    'suit': suits[s],
-                    'rank': str(r)
-                }
-                self.deck.append(card)
-
-    def deal_hand(self, cards_to_deal):
-        hand = []
-        for i in xrange(cards_to_deal):
-            card = random.choice(self.deck)
-            self.deck.remove(card)
-            hand.append(card)
-        return hand
+from cards import card_to_dict, format_cards
+from engine import (
+    GameState,
+    GO_FISH,
+    MISSING_RANK,
+    NOT_YOUR_TURN,
+    apply_move,
+    deal,
+    new_seed)
+from models import counter
+from models.properties import CardListProperty
+
+
+# Storage layouts. 'players' keeps each Player and Move as a child entity of
+# the Game, 'embedded' keeps them inside the Game entity so a game is one get
+# and one put.
+LAYOUT_PLAYERS = 'players'
+LAYOUT_EMBEDDED = 'embedded'
+LAYOUTS = (LAYOUT_PLAYERS, LAYOUT_EMBEDDED)
 
 
 class Game(ndb.Model):
     """Game object"""
     player_names = ndb.StringProperty(repeated=True)
     turn = ndb.StringProperty(required=False, default="")
-    started_on = ndb.DateTimeProperty(required=True, default=datetime.now())
-    deck = ndb.JsonProperty()
+    started_on = ndb.DateTimeProperty(required=True, auto_now_add=True)
+    # last write of the game, used to find idle games
+    updated_on = ndb.DateTimeProperty(auto_now=True)
+    deck = CardListProperty()
     history = ndb.JsonProperty(default=[])
     game_over = ndb.BooleanProperty(required=True, default=False)
     matches_to_win = ndb.IntegerProperty(required=True)
     cards_dealt = ndb.IntegerProperty(required=True)
+    seed = ndb.IntegerProperty(indexed=False)
+
+    # incremented by every move that changes the game, see api.make_move
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+    # number of moves logged, None for games created before moves were
+    # keyed by sequence number
+    move_count = ndb.IntegerProperty(indexed=False)
+
+    layout = ndb.StringProperty(default=LAYOUT_PLAYERS, choices=LAYOUTS,
+                                indexed=False)
+    embedded_players = ndb.LocalStructuredProperty(
+        Player, repeated=True, keep_keys=True)
+    move_log = ndb.LocalStructuredProperty(
+        Move, repeated=True, compressed=True)
     winner = ndb.StringProperty()
     loser = ndb.StringProperty()
 
+    # copies of player_names that summary listings can project
+    player1 = ndb.ComputedProperty(
+        lambda self: self.player_names[0] if self.player_names else None)
+    player2 = ndb.ComputedProperty(
+        lambda self: (self.player_names[1]
+                      if len(self.player_names) > 1 else None))
+
     @classmethod
-    def new_game(cls, user1, user2, matches, cards):
-        """Creates and returns a new game"""
-        game = cls(matches_to_win=matches, cards_dealt=cards)
-        game_key = game.put()
-
-        player1 = Player(parent=game_key,
-                         user=user1.key,
-                         opponent=user2.name,
-                         game_url=game.key.urlsafe(),
-                         name=user1.name)
-
-        player2 = Player(parent=game_key,
-                         user=user2.key,
-                         opponent=user1.name,
-                         game_url=game.key.urlsafe(),
-                         name=user2.name)
-
-        # create deck
-        deck = Deck()
-        deck.create_deck()
-
-        # deal hand and check for pairs in hand
-        player1.hand = deck.deal_hand(cards)
-        player1.check_pairs()
-        player1.put()
-
-        # deal hand and check for pairs in hand
-        player2.hand = deck.deal_hand(cards)
-        player2.check_pairs()
-        player2.put()
-
-        # check to see if players have ran out of cards or hit target matches
-        if player1.check_game_over(matches):
-            game.end_game(player1, player2)
-
-        elif player2.check_game_over(matches):
-            game.end_game(player2, player1)
-
-        # add player names to the game
-        game.player_names.append(player1.name)
-        game.player_names.append(player2.name)
-
-        game.deck = deck.deck
-        game.turn = player1.name
-        game.put()
+    @ndb.transactional(xg=True)
+    def new_game(cls, user1, user2, matches, cards, seed=None,
+                 layout=LAYOUT_PLAYERS):
+        """Creates and returns a new game dealt by engine.deal. The deck is
+        shuffled with a random.Random seeded by seed, which is stored on the
+        game so deals can be replayed. A random seed is used if none is
+        given. The game and both players are written with one put_multi in a
+        transaction, or as the single Game entity with the embedded layout."""
+        if seed is None:
+            seed = new_seed()
+
+        game_key = ndb.Key(cls, cls.allocate_ids(1)[0])
+        game = cls(key=game_key,
+                   matches_to_win=matches,
+                   cards_dealt=cards,
+                   seed=seed,
+                   layout=layout,
+                   move_count=0,
+                   player_names=[user1.name, user2.name])
+
+        state = deal([user1.name, user2.name], cards, matches, seed)
+        players = []
+        for user, opponent, player_state in zip((user1, user2),
+                                                (user2, user1),
+                                                state.players):
+            players.append(Player(key=Player.key_for(game_key, user.name),
+                                  user=user.key,
+                                  opponent=opponent.name,
+                                  game_url=game_key.urlsafe(),
+                                  name=user.name,
+                                  hand=player_state.hand,
+                                  matches=player_state.matches,
+                                  num_matches=player_state.num_matches))
+        player1, player2 = players
+
+        game.deck = state.deck
+        counter.increment(counter.GAMES_STARTED)
+
+        # players can run out of cards or hit target matches on the deal
+        if state.game_over:
+            if state.winner == player1.name:
+                game.end_game(player1, player2)
+            else:
+                game.end_game(player2, player1)
+        else:
+            game.turn = state.turn
+
+        if layout == LAYOUT_EMBEDDED:
+            game.embedded_players = [player1, player2]
+            game.put()
+        else:
+            ndb.put_multi([game, player1, player2])
+
+        # a game that ended on the deal was never active
+        if not game.game_over:
+            User.add_active_game([user1.key, user2.key], game_key)
+            counter.increment(counter.ACTIVE_GAMES)
+
+        # keep the freshly dealt players for to_form
+        game._players = [player1, player2]
 
         return game
 
     @classmethod
     def make_guess(cls, game, player, guess):
-        """Checks players turn and processes players guess"""
-        from utils import get_player_by_game
-
+        """Checks players turn and processes players guess with
+        engine.apply_move. guess is a rank name from cards.RANKS. Only the
+        sharded counters are written, the caller puts the move and the
+        changed entities in the same transaction.
+        Returns:
+            The Move and the list of Game and Player entities it changed."""
         move = Move(
             parent=game.key,
             player=player.key,
@@ -124,110 +146,197 @@ class Game(ndb.Model):
             game_over=False
         )
 
-        # check to make sure it is the players turns
-        if player.name != game.turn:
-            move.message = "Sorry, it is not your turn. {} please make a move".format(
-                game.turn)
-            return move
+        opponent = game.get_opponent(player)
+        if game.seed is None:
+            game.shuffle_legacy_deck()
 
-        else:
-            # set player1 and player2
-            player_index = game.player_names.index(player.name)
-            if player_index == 0:
-                opponent = get_player_by_game(game.player_names[1], game)
-            else:
-                opponent = get_player_by_game(game.player_names[0], game)
+        # the engine changes hands, matches, history and the deck in place
+        players = [player.to_state(), opponent.to_state()]
+        state = GameState(players, game.deck, game.turn, game.matches_to_win)
+        state, events = apply_move(state, player.name, guess)
+        player.num_matches = players[0].num_matches
+        opponent.num_matches = players[1].num_matches
 
-            # create a list of card values only
-            pl_values = [x['rank'] for x in player.hand]
-            opp_values = [x['rank'] for x in opponent.hand]
+        event = events[0]
+        if event.kind == NOT_YOUR_TURN:
+            move.message = "Sorry, it is not your turn. {} please make a move".format(
+                game.turn)
+            return move, []
 
-            # make sure player has their guess in their own hand
-            if guess not in pl_values:
-                move.message = "Sorry, {} does not have a {} in hand. Please guess again.".format(
-                    player.name, guess)
-                return move
+        if event.kind == MISSING_RANK:
+            move.message = "Sorry, {} does not have a {} in hand. Please guess again.".format(
+                player.name, guess)
+            return move, []
 
-            else:
-                player.history.append(guess)
-            # check to see if guess is in player2 hand
-            if guess in opp_values:
-                move.match = True
-                move.message = "Match, please go again."
-
-                # find card in players hand
-                pl_index = pl_values.index(guess)
-                pl_card = player.hand[pl_index]
-                opp_index = opp_values.index(guess)
-                opp_card = opponent.hand[opp_index]
-
-                # add match to player1 matches
-                player.matches.append(pl_card)
-                player.matches.append(opp_card)
-
-                # remove cards from both players hands
-                player.hand.remove(pl_card)
-                opponent.hand.remove(opp_card)
-
-                player.num_matches += 1
-
-                player.put()
-                opponent.put()
-
-                if player.check_game_over(game.matches_to_win):
-                    game.end_game(player, opponent)
-                    move.game_over = True
-                    move.message = "Game over, {} is the winner".format(
-                        player.name)
-                    return move
-
-                if opponent.check_game_over(game.matches_to_win):
-                    game.end_game(opponent, player)
-                    move.game_over = True
-                    move.message = "Game over, {} is the winner".format(
-                        opponent.name)
-                    return move
-
-                return move
+        counter.increment(counter.TOTAL_MOVES)
 
+        if event.kind == GO_FISH:
+            changed = [game, player]
+            if event.card is None:
+                move.message = "No match, Go fish. The deck is empty."
             else:
+                move.message = "No match, Go fish. {} drew {}".format(
+                    player.name, card_to_dict(event.card))
+        else:
+            changed = [player, opponent]
+            move.match = True
+            move.message = "Match, please go again."
 
-                # add the go fish card to players hand and remove from deck
-                card = random.choice(game.deck)
-                game.deck.remove(card)
-                player.hand.append(card)
-                player.put()
+        if not state.game_over:
+            game.turn = state.turn
+            return move, changed
 
-                # check from matches and if game is over
-                player.check_pairs()
+        if state.winner == player.name:
+            game.end_game(player, opponent)
+        else:
+            game.end_game(opponent, player)
+        counter.increment(counter.ACTIVE_GAMES, -1)
 
-                # change game turn
-                game.turn = opponent.name
-                game.put()
+        move.game_over = True
+        move.message = "Game over, {} is the winner".format(state.winner)
+        return move, [game, player, opponent]
 
-                move.message = "No match, Go fish. {} drew {}".format(
-                    player.name, card, player.hand)
-                return move
+    @classmethod
+    @ndb.transactional(xg=True)
+    def cancel_if_idle(cls, game_key, cutoff):
+        """Cancels a live game that has not been played since cutoff.
+        Returns False if the game is gone, over or was played meanwhile."""
+        game = game_key.get()
+        if not game or game.game_over:
+            return False
+        if game.last_played() >= cutoff:
+            return False
+
+        game.cancel()
+        return True
+
+    def last_played(self):
+        """Returns when the game was last written. Games not written since
+        updated_on was added fall back to the time of their last move, or
+        the time they were started."""
+        if self.updated_on:
+            return self.updated_on
+
+        if self.layout == LAYOUT_EMBEDDED:
+            moves = self.move_log[-1:]
+        else:
+            moves = Move.query(ancestor=self.key).order(-Move.time).fetch(1)
+        return moves[0].time if moves else self.started_on
+
+    def cancel(self):
+        """Deletes the game with every Player and Move under it, using one
+        keys-only ancestor query and one delete_multi, and removes it from
+        both users' active games. Call it in a cross-group transaction."""
+        user_keys = [player.user for player in self.get_players() if player]
+        ndb.delete_multi(ndb.Query(ancestor=self.key).fetch(keys_only=True))
+        User.remove_active_game(user_keys, self.key)
+        counter.increment(counter.ACTIVE_GAMES, -1)
+
+    def shuffle_legacy_deck(self):
+        """Shuffles the remaining deck of a game dealt before decks were
+        shuffled once and stores the seed used."""
+        self.seed = new_seed()
+        random.Random(self.seed).shuffle(self.deck)
+
+    def entities_to_put(self, move, changed):
+        """Returns the entities to write for a move and the entities it
+        changed. A rejected guess changed nothing and writes nothing. With
+        the embedded layout the move is appended to the move log and only the
+        Game is written. Otherwise the move is keyed by the next number of
+        the game's move sequence, and the game is written with every move to
+        keep move_count."""
+        if not changed:
+            return []
+
+        if self.move_count is not None:
+            self.move_count += 1
+
+        if self.layout == LAYOUT_EMBEDDED:
+            self.move_log.append(move)
+            return [self]
+
+        if self.move_count is None:
+            return [move] + changed
+
+        move.key = ndb.Key(Move, self.move_count, parent=self.key)
+        return [move, self] + [entity for entity in changed
+                               if entity is not self]
+
+    def move_query(self):
+        """Returns a query for the Move entities of the game in move order.
+        Sequenced moves are read by key, which needs no composite index,
+        older games are ordered by time."""
+        query = Move.query(ancestor=self.key)
+        if self.move_count is None:
+            return query.order(Move.time)
+        return query.order(Move.key)
+
+    @ndb.tasklet
+    def get_players_async(self):
+        """Returns a Future for both Players of the game in player_names
+        order. They are fetched with one get_multi on their deterministic
+        keys and kept on the entity, so every later lookup for this game
+        reuses them. Embedded players need no fetch."""
+        if self.layout == LAYOUT_EMBEDDED:
+            raise ndb.Return(self.embedded_players)
+
+        if getattr(self, '_players', None) is None:
+            players = yield ndb.get_multi_async(
+                [Player.key_for(self.key, name) for name in self.player_names])
+
+            # Players created before deterministic keys have numeric ids
+            if None in players:
+                legacy = yield Player.query(ancestor=self.key).fetch_async(2)
+                by_name = dict((player.name, player) for player in legacy)
+                players = [by_name.get(name) for name in self.player_names]
+
+            self._players = players
+
+        raise ndb.Return(self._players)
+
+    def get_players(self):
+        """Returns both Players of the game in player_names order"""
+        return self.get_players_async().get_result()
+
+    def get_player(self, username):
+        """Returns the Player for username or None if not in the game"""
+        name = username.title()
+        for player in self.get_players():
+            if player and player.name == name:
+                return player
+
+        return None
+
+    def get_opponent(self, player):
+        """Returns the other Player of the game"""
+        player1, player2 = self.get_players()
+        if player.name == player1.name:
+            return player2
+        else:
+            return player1
 
     def to_form(self, message):
         """Returns a GameForm representation of the Game"""
-        from utils import get_player_by_game
+        return self.to_form_async(message).get_result()
 
-        # get players
-        player1 = get_player_by_game(self.player_names[0], self)
-        player2 = get_player_by_game(self.player_names[1], self)
+    @ndb.tasklet
+    def to_form_async(self, message):
+        """Returns a Future for a GameForm representation of the Game. Player
+        loads of concurrent calls are batched together by ndb."""
+        player1, player2 = yield self.get_players_async()
 
         form = GameForm()
         form.started_on = self.started_on
         form.urlsafe_key = self.key.urlsafe()
         form.player1 = player1.name
-        form.player1_hand = str(player1.hand)
+        form.player1_hand = format_cards(player1.hand)
         form.player1_matches = player1.num_matches
         form.player2 = player2.name
-        form.player2_hand = str(player2.hand)
+        form.player2_hand = format_cards(player2.hand)
         form.player2_matches = player2.num_matches
         form.game_over = self.game_over
         form.matches_to_win = self.matches_to_win
+        form.version = self.version
 
         if not self.game_over:
             form.turn = self.turn
@@ -235,13 +344,38 @@ class Game(ndb.Model):
             form.winner = self.winner
 
         form.message = message
+        raise ndb.Return(form)
+
+    def to_summary_form(self, game_over=None):
+        """Returns a GameSummaryForm representation of a projected Game.
+        game_over is given when the query filtered on it."""
+        if game_over is None:
+            game_over = self.game_over
+
+        form = GameSummaryForm()
+        form.urlsafe_key = self.key.urlsafe()
+        form.players = [self.player1, self.player2]
+        form.game_over = game_over
+
+        if not game_over:
+            form.turn = self.turn
+        else:
+            form.winner = self.winner
+
         return form
 
     def end_game(self, winner, loser):
-        """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
+        """Ends the game, counts the result on the sharded counters and
+        removes it from both users' active games. The caller puts the game
+        in the same cross-group transaction. The wins and losses on User are
+        only set by the scoreboard reconciliation, so results of a busy
+        player spread over counter shards."""
         del self.turn
         self.game_over = True
         self.winner = winner.name
         self.loser = loser.name
-        self.put()
+
+        counter.increment(counter.wins_counter(winner.name))
+        counter.increment(counter.losses_counter(loser.name))
+        counter.increment(counter.GAMES_PLAYED)
+        User.remove_active_game([winner.user, loser.user], self.key)
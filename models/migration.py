@@ -0,0 +1,32 @@
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+CACHE_PREFIX = 'migration_done:'
+
+# seconds a "not done yet" answer is cached, done is final
+PENDING_TTL = 10 * 60
+
+
+class Migration(ndb.Model):
+    """Marks that a migration from migrations.MIGRATIONS has finished. Keyed
+    by the migration name. Code that falls back to data written before a
+    migration checks is_done to skip the fallback afterwards."""
+    finished_on = ndb.DateTimeProperty(auto_now_add=True)
+
+    @classmethod
+    def is_done(cls, name):
+        """Returns True if the migration name has finished. The answer is
+        cached in memcache, so checking costs no datastore get."""
+        done = memcache.get(CACHE_PREFIX + name)
+        if done is None:
+            done = cls.get_by_id(name) is not None
+            memcache.set(CACHE_PREFIX + name, done,
+                         time=0 if done else PENDING_TTL)
+
+        return done
+
+    @classmethod
+    def mark_done(cls, name):
+        """Records that the migration name has finished"""
+        cls(id=name).put()
+        memcache.set(CACHE_PREFIX + name, True)
@@ -1,14 +1,15 @@
-from datetime import datetime
 from google.appengine.ext import ndb
 
 from forms import GameHistoryForm
 
 
 class Move(ndb.Model):
-    """Move object for guesses in a game"""
+    """Move object for guesses in a game. Moves of games with a move_count
+    are keyed by their sequence number in the game, see
+    Game.entities_to_put."""
     player = ndb.KeyProperty(required=True, kind='Player')
     name = ndb.StringProperty(required=True)
-    time = ndb.DateTimeProperty(required=True, default=datetime.now())
+    time = ndb.DateTimeProperty(required=True, auto_now_add=True)
     guess = ndb.StringProperty(required=True)
     match = ndb.BooleanProperty(required=True)
     game_over = ndb.BooleanProperty(required=True)
@@ -0,0 +1,34 @@
+from google.appengine.ext import ndb
+
+from cards import Hand, pack_cards, unpack_cards
+
+
+class CardListProperty(ndb.BlobProperty):
+    """A list of integer cards stored as packed bytes. Values written by the
+    JsonProperty it replaced are read back as cards."""
+
+    def _validate(self, value):
+        if not isinstance(value, list):
+            raise TypeError('Expected a list of cards, got {!r}'.format(value))
+
+    def _to_base_value(self, value):
+        return pack_cards(value)
+
+    def _from_base_value(self, value):
+        return unpack_cards(value)
+
+
+class HandProperty(CardListProperty):
+    """A Hand stored as a packed list of cards"""
+
+    def _validate(self, value):
+        if isinstance(value, list):
+            return Hand(value)
+        if not isinstance(value, Hand):
+            raise TypeError('Expected a Hand, got {!r}'.format(value))
+
+    def _to_base_value(self, value):
+        return value.cards()
+
+    def _from_base_value(self, value):
+        return Hand(value)
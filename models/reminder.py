@@ -0,0 +1,32 @@
+from google.appengine.ext import ndb
+
+from models.user import User
+
+
+class Reminder(ndb.Model):
+    """Marks that a user was sent the reminder email of a day. Keyed by the
+    day and the normalized username."""
+    sent_on = ndb.DateTimeProperty(auto_now_add=True)
+
+    @classmethod
+    @ndb.transactional
+    def claim(cls, username, day):
+        """Records the reminder of day for username. Returns False if it was
+        already recorded, so the email must not be sent again."""
+        key = cls.key_for(username, day)
+        if key.get():
+            return False
+
+        cls(key=key).put()
+        return True
+
+    @classmethod
+    def release(cls, username, day):
+        """Removes the claim of the reminder of day for username after its
+        email could not be sent, so a retry sends it"""
+        cls.key_for(username, day).delete()
+
+    @classmethod
+    def key_for(cls, username, day):
+        """Returns the key of the reminder of day for username"""
+        return ndb.Key(cls, '{}:{}'.format(day, User.normalize(username)))
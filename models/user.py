@@ -1,6 +1,7 @@
 from google.appengine.ext import ndb
 
 from forms import UserScoreForm
+from models.migration import Migration
 
 
 class User(ndb.Model):
@@ -13,9 +14,100 @@ class User(ndb.Model):
     games = ndb.IntegerProperty(default=0)
     win_ratio = ndb.FloatProperty(default=0)
 
+    # keys of the games the user is playing, kept by Game.new_game,
+    # end_game and cancel_game
+    active_games = ndb.KeyProperty(kind='Game', repeated=True)
+
+    @staticmethod
+    def normalize(username):
+        """Returns the normalized username used as the key id"""
+        return username.strip().lower()
+
+    @classmethod
+    def key_for(cls, username):
+        """Returns the deterministic Key for a username"""
+        return ndb.Key(cls, cls.normalize(username))
+
+    @classmethod
+    def get_by_name(cls, username):
+        """Returns the User for a username or None. Until the rekey
+        migration has finished, users that have not been rekeyed yet by
+        migrations.rekey_users are found by name query."""
+        user = cls.key_for(username).get()
+        if user is None and not Migration.is_done('rekey'):
+            user = cls.query(cls.name == username.strip().title()).get()
+
+        return user
+
+    @classmethod
+    @ndb.transactional
+    def create(cls, username, email=None):
+        """Creates a User under its deterministic key. Returns None if the
+        key is already taken."""
+        key = cls.key_for(username)
+        if key.get():
+            return None
+
+        user = cls(key=key, name=username.strip().title(), email=email)
+        user.put()
+        return user
+
+    def set_record(self, wins, losses):
+        """Sets wins, losses, games played and win ratio"""
+        self.wins = wins
+        self.losses = losses
+        self.games = wins + losses
+
+        if self.games:
+            self.win_ratio = float(self.wins) / float(self.games)
+        else:
+            self.win_ratio = 0.0
+
+    @staticmethod
+    @ndb.transactional
+    def add_missing_results(user_key, wins, losses):
+        """Raises a user's record to at least wins and losses. Used by the
+        scoreboard reconciliation to copy the counter totals, which only
+        grow, onto the User, so ranking order follows them. Returns True if
+        the record was changed."""
+        user = user_key.get()
+        if not user or (user.wins >= wins and user.losses >= losses):
+            return False
+
+        user.set_record(max(user.wins, wins), max(user.losses, losses))
+        user.put()
+        return True
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def add_active_game(user_keys, game_key):
+        """Adds a game to the active games of its users that exist"""
+        users = [user for user in ndb.get_multi(user_keys) if user]
+        for user in users:
+            if game_key not in user.active_games:
+                user.active_games.append(game_key)
+
+        ndb.put_multi(users)
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def remove_active_game(user_keys, game_key):
+        """Removes a finished or cancelled game from the active games of its
+        users"""
+        users = [user for user in ndb.get_multi(user_keys) if user]
+        for user in users:
+            if game_key in user.active_games:
+                user.active_games.remove(game_key)
+
+        ndb.put_multi(users)
+
     # scoreboard output
-    def to_form(self):
-        """Returns Users results - all completed games, wins and losses"""
+    def to_form(self, wins=None, losses=None):
+        """Returns Users results - all completed games, wins and losses.
+        wins and losses are given when read from the sharded counters."""
+        if wins is not None:
+            self.set_record(wins, losses)
+
         form = UserScoreForm()
         form.player = self.name
         form.games_played = self.games
@@ -0,0 +1,66 @@
+"""scheduling.py - Coalesces scoreboard refresh triggers so that at most one
+reconciliation task runs per time window."""
+
+import logging
+import time
+from datetime import datetime
+
+from google.appengine.api import memcache, taskqueue
+
+SCOREBOARD_URL = '/tasks/cache_scoreboard'
+
+# length of a coalescing window in seconds
+SCOREBOARD_WINDOW = 300
+
+COUNTER_PREFIX = 'scoreboard_triggers:'
+COUNTERS = ('received', 'skipped', 'coalesced', 'enqueued')
+
+
+def schedule_scoreboard_refresh(game_over=False, user_created=False):
+    """Schedules a scoreboard reconciliation for the current time window.
+        Triggers that did not end a game or create a user are skipped. All
+        other triggers in the same window share one named task that runs when
+        the window closes.
+    Args:
+        game_over: True if the triggering move ended a game
+        user_created: True if the trigger is a newly created User
+    Returns:
+        True if a task was enqueued, False if the trigger was suppressed."""
+    _count('received')
+
+    if not (game_over or user_created):
+        _count('skipped')
+        return False
+
+    bucket = int(time.time()) // SCOREBOARD_WINDOW
+
+    # memcache catches most duplicates without a task queue call, the task
+    # name catches the rest if memcache was flushed
+    if not memcache.add('scoreboard_bucket:{}'.format(bucket), 1,
+                        time=SCOREBOARD_WINDOW * 2):
+        _count('coalesced')
+        return False
+
+    try:
+        taskqueue.add(
+            url=SCOREBOARD_URL,
+            name='cache-scoreboard-{}'.format(bucket),
+            eta=datetime.utcfromtimestamp((bucket + 1) * SCOREBOARD_WINDOW))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        _count('coalesced')
+        return False
+
+    _count('enqueued')
+    return True
+
+
+def get_trigger_counts():
+    """Returns a dict of scoreboard trigger counters"""
+    counts = memcache.get_multi(COUNTERS, key_prefix=COUNTER_PREFIX)
+    return dict((name, counts.get(name, 0)) for name in COUNTERS)
+
+
+def _count(name):
+    """Increments a scoreboard trigger counter"""
+    if memcache.incr(COUNTER_PREFIX + name, initial_value=0) is None:
+        logging.warning('Unable to increment trigger counter %s', name)
@@ -1,13 +1,22 @@
 """utils.py - File for collecting general utility functions."""
 
 import logging
+import random
+import time
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 from models.game import Game
-from models.player import Player
 from models.user import User
 
 import endpoints
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+TRANSACTION_RETRIES = 4
+TRANSACTION_BACKOFF = 0.05
+
 
 def get_by_urlsafe(urlsafe, model):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
@@ -49,7 +58,7 @@ def check_user_exists(username):
         The entity that the username string points to.
     Raises:
         NotFoundException if no User entity is found"""
-    user = User.query(User.name == username.title()).get()
+    user = User.get_by_name(username)
 
     if not user:
         raise endpoints.NotFoundException(
@@ -60,8 +69,9 @@ def check_user_exists(username):
 
 def get_player_by_game(username, game):
     """Returns an Player (ndb.Model) entity for a given username and game.
-        First verify username and game entity are valid, raises error if not.
-        Then returns the Player entity for the given user in the game.
+        First verify the game entity is valid, raises error if not.
+        Then returns the Player entity for the given user in the game from
+        the players loaded once per game by Game.get_players.
         Raises an error if a Player is not found.
     Args:
         username: Username string
@@ -69,25 +79,130 @@ def get_player_by_game(username, game):
     Returns:
         The Player entity for a username in the given game.
     Raises:
-        NotFoundException if no User entity is found from the given username.
         NotFoundException Game entity is not valid.
         NotFoundException if no Player entity is found."""
 
-    # check to make sure User exists
-    if not check_user_exists(username):
-        raise endpoints.NotFoundException(
-            '{} does not exist!'.format(username))
-
     # check to see if game is a valid Game entity
     if not isinstance(game, Game):
         raise endpoints.NotFoundException('Game not found')
 
     # check to see if Player is in this game
-    player = Player.query(
-        ancestor=game.key).filter(
-        Player.name == username.title()).get()
+    player = game.get_player(username)
     if not player:
         raise endpoints.NotFoundException(
             '{} is not in this game'.format(username))
     else:
         return player
+
+
+def get_page_limit(request):
+    """Returns the page size of a paged request, the default if no limit was
+        sent and at most MAX_PAGE_SIZE.
+    Args:
+        request: A request message with an optional limit field
+    Returns:
+        The number of results of the page.
+    Raises:
+        BadRequestException if the limit is less than 1"""
+    if request.limit is None:
+        return DEFAULT_PAGE_SIZE
+
+    if request.limit < 1:
+        raise endpoints.BadRequestException('limit must be at least 1')
+
+    return min(request.limit, MAX_PAGE_SIZE)
+
+
+def get_page_cursor(request):
+    """Returns the ndb Cursor a paged request starts from. Raises an error if
+        the cursor string is malformed.
+    Args:
+        request: A request message with an optional cursor field
+    Returns:
+        The Cursor for the request or None for the first page.
+    Raises:
+        BadRequestException if the cursor is not valid"""
+    return parse_cursor(request.cursor)
+
+
+def parse_cursor(urlsafe):
+    """Returns the ndb Cursor of a urlsafe cursor string, None for an empty
+        string. Raises BadRequestException if the string is malformed."""
+    if not urlsafe:
+        return None
+
+    try:
+        return Cursor(urlsafe=urlsafe)
+    except (datastore_errors.BadValueError, TypeError):
+        raise endpoints.BadRequestException('Invalid cursor')
+
+
+@ndb.tasklet
+def fetch_page_async(query, request, **options):
+    """Returns a Future for one page of query results for a paged request.
+    Args:
+        query: ndb.Query to fetch from
+        request: A request message with optional limit and cursor fields
+        options: Extra query options such as projection
+    Returns:
+        A tuple of the page results and the urlsafe cursor of the next page,
+        which is None on the last page."""
+    limit = get_page_limit(request)
+    results, cursor, more = yield query.fetch_page_async(
+        limit, start_cursor=get_page_cursor(request), **options)
+
+    if more and cursor:
+        raise ndb.Return(results, cursor.urlsafe())
+    raise ndb.Return(results, None)
+
+
+def fetch_page(query, request, **options):
+    """Returns one page of query results and the next page cursor"""
+    return fetch_page_async(query, request, **options).get_result()
+
+
+def transaction_with_backoff(func, *args, **kwargs):
+    """Runs func in a cross-group transaction. When the commit fails because
+        of contention the transaction is retried after an exponentially
+        growing, jittered delay.
+    Args:
+        func: The function to run, it must be safe to run more than once
+        args, kwargs: Arguments for func
+    Returns:
+        The return value of func.
+    Raises:
+        TransactionFailedError if every attempt failed."""
+    delay = TRANSACTION_BACKOFF
+    for attempt in xrange(TRANSACTION_RETRIES + 1):
+        try:
+            return ndb.transaction(lambda: func(*args, **kwargs),
+                                   xg=True, retries=0)
+        except datastore_errors.TransactionFailedError:
+            if attempt == TRANSACTION_RETRIES:
+                raise
+            logging.info('Transaction contention, retry %d', attempt + 1)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay *= 2
+
+
+def slice_page(items, request):
+    """Returns one page of an in memory list for a paged request. The cursor
+        of a list page is the index of its first item.
+    Args:
+        items: The list to page through
+        request: A request message with optional limit and cursor fields
+    Returns:
+        A tuple of the page items and the cursor of the next page, which is
+        None on the last page.
+    Raises:
+        BadRequestException if the cursor is not valid"""
+    limit = get_page_limit(request)
+    try:
+        start = int(request.cursor or 0)
+    except ValueError:
+        raise endpoints.BadRequestException('Invalid cursor')
+    if start < 0:
+        raise endpoints.BadRequestException('Invalid cursor')
+
+    end = start + limit
+    return items[start:end], str(end) if end < len(items) else None